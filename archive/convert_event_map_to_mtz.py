@@ -22,37 +22,29 @@ import getopt
 import glob
 import sys
 import os
+import shutil
+import tempfile
+import time
+import json
+import hashlib
+import itertools
+import multiprocessing
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 import gemmi
 
 def get_axis_order(map_name, maps):
     print('>> checking axis order...')
-    cmd = (
-        'mapmask mapin {0!s} << eof > mapmask.log\n'.format(maps) +
-        ' end\n'
-        'eof\n'
-    )
-
-    print('running mapdump to get axis order for {0!s}'.format(map_name))
-    
-    os.system(cmd)
-
-    if os.path.isfile('mapmask.log'):
-        for line in open('mapmask.log'):
-            if 'Fast, medium, slow axes' in line:
-                a = line.split()[5]
-                b = line.split()[6]
-                c = line.split()[7]
-                print('axis order of maps is : {0!s} {1!s} {2!s}'.format(a, b, c))
-                break
-
-    os.remove('mapmask.log')
+    print('reading header of {0!s} to get axis order'.format(map_name))
+    m = gemmi.read_ccp4_map(maps)
+    # words 17-19 of the CCP4 header (MAPC, MAPR, MAPS) map columns, rows and sections to axes 1-3
+    a, b, c = ['XYZ'[m.header_i32(n) - 1] for n in (17, 18, 19)]
+    print('axis order of maps is : {0!s} {1!s} {2!s}'.format(a, b, c))
 
 
 def change_axis_order(map_name, tmp_map_name, axisOrder):
-    if len(axisOrder) != 3:
-        print('ERROR: axis order needs to contain three characters of type X, Y and Z')
-        sys.exit(2)
-
     a = axisOrder[0].upper()
     b = axisOrder[1].upper()
     c = axisOrder[2].upper()
@@ -71,85 +63,223 @@ def change_axis_order(map_name, tmp_map_name, axisOrder):
 
 
 def get_resolution(pandda_input_mtz):
-    m = gemmi.read_mtz_file(pandda_input_mtz)
+    # the resolution range is part of the MTZ header; no need to read the reflections
+    m = gemmi.read_mtz_file(pandda_input_mtz, with_data=False)
     highres = m.resolution_high()
     return highres
 
-def run_gemmi_map2sf(map_name, mtz_name,  dmin):
-    print('>> runnning gemmi map2sf...')
+def get_cached_resolution(resolution_cache, pandda_input_mtz):
+    # entries are only used as long as size and mtime of the MTZ file did not change
+    st = os.stat(pandda_input_mtz)
+    entry = resolution_cache.get(pandda_input_mtz)
+    if entry and entry[:2] == [st.st_size, st.st_mtime]:
+        return entry[2]
+    dmin = get_resolution(pandda_input_mtz)
+    resolution_cache[pandda_input_mtz] = [st.st_size, st.st_mtime, dmin]
+    return dmin
+
+def read_cache(cache_file):
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file) as f:
+                return json.load(f)
+        except ValueError:
+            print('WARNING: cannot read {0!s}; ignoring it'.format(cache_file))
+    return {}
+
+def write_cache(cache_file, cache):
+    # the plugin starts one conversion per map, so other runs might have added entries in the meantime;
+    # every run writes its own temporary file, which is renamed once it is complete
+    with open(cache_file + '.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        merged = read_cache(cache_file)
+        for section in cache:
+            merged.setdefault(section, {}).update(cache[section])
+        fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(cache_file), dir=os.path.dirname(cache_file))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(merged, f, indent=1, sort_keys=True)
+        os.chmod(tmp, 0o644)
+        if os.name == 'nt' and os.path.isfile(cache_file):
+            os.remove(cache_file)
+        os.rename(tmp, cache_file)
+
+def get_columns(map_name):
     if 'z_map' in map_name:
-        cmd = 'gemmi map2sf %s %s DELFWT PHDELWT --dmin=%s' % (map_name, mtz_name, dmin)
-    else:
-        cmd = 'gemmi map2sf %s %s FWT PHWT --dmin=%s' % (map_name, mtz_name, dmin)
-    os.system(cmd)
+        return 'DELFWT', 'PHDELWT'
+    return 'FWT', 'PHWT'
 
-def run_cinvfft(map_name, pandda_input_mtz, mtz_name):
+def run_gemmi_map2sf(map_name, mtz_name, dmin, columns):
+    # same as 'gemmi map2sf', but without starting a new process and reading the map twice
+    print('>> running gemmi map to structure factor conversion...')
+    m = gemmi.read_ccp4_map(map_name)
+    # reorders the axes to X, Y, Z and expands the map to the whole unit cell in memory
+    m.setup(0.0)
+    sf = gemmi.transform_map_to_f_phi(m.grid, half_l=True)
+    data = sf.prepare_asu_data(dmin=dmin)
+    mtz = gemmi.Mtz(with_base=True)
+    mtz.spacegroup = sf.spacegroup
+    mtz.set_cell_for_all(sf.unit_cell)
+    mtz.add_dataset('unknown')
+    mtz.add_column(columns[0], 'F')
+    mtz.add_column(columns[1], 'P')
+    mtz.set_data(data)
+    mtz.write_to_file(mtz_name)
+
+def run_cinvfft(map_name, pandda_input_mtz, mtz_name, columns, tmpDir):
+    # all intermediate files go into tmpDir so that several conversions can run at the same time
     print('>> running cinvfft...')
-    cmd = 'cinvfft -mapin {0!s} -mtzin {1!s} -mtzout tmp.mtz -colout tmp > cinvfft.log'.format(map_name, pandda_input_mtz)
+    tmp_mtz = os.path.join(tmpDir, 'tmp.mtz')
+    cmd = 'cinvfft -mapin {0!s} -mtzin {1!s} -mtzout {2!s} -colout tmp > {3!s}'.format(
+        map_name, pandda_input_mtz, tmp_mtz, os.path.join(tmpDir, 'cinvfft.log'))
     os.system(cmd)
     print('>> running cad...')
-    if 'z_map' in map_name:
-        cmd = (
-            'cad hklin1 tmp.mtz hklout {0!s} << eof > cad.log\n'.format(mtz_name) +
-            'LABIN FILE_NUMBER 1 E1=tmp.F_phi.F E2=tmp.F_phi.phi\n'
-            'LABOUT FILE_NUMBER 1 E1=DELFWT E2=PHDELWT\n'
-            'eof'
-        )
-    else:
-        cmd = (
-            'cad hklin1 tmp.mtz hklout {0!s} << eof > cad.log\n'.format(mtz_name) +
-            'LABIN FILE_NUMBER 1 E1=tmp.F_phi.F E2=tmp.F_phi.phi\n'
-            'LABOUT FILE_NUMBER 1 E1=FWT E2=PHWT\n'
-            'eof'
-        )
+    cmd = (
+        'cad hklin1 {0!s} hklout {1!s} << eof > {2!s}\n'.format(tmp_mtz, mtz_name, os.path.join(tmpDir, 'cad.log')) +
+        'LABIN FILE_NUMBER 1 E1=tmp.F_phi.F E2=tmp.F_phi.phi\n'
+        'LABOUT FILE_NUMBER 1 E1={0!s} E2={1!s}\n'.format(columns[0], columns[1]) +
+        'eof'
+    )
     os.system(cmd)
-    os.system('/bin/rm -f tmp.mtz cinvfft.log cad.log')
 
 
-def remove_temp_map(tmp_map_name):
-    if os.path.isfile(tmp_map_name):
-        os.remove(tmp_map_name)
+def get_checksum(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
 
-def convert_event_maps_to_mtz(panddaDir, mydir, axisOrder, overwrite, checkOrder, cinvfft):
-    print('>>> looking for event maps in {0!s}'.format(panddaDir))
-    sampleList = []
-    if os.path.isdir(panddaDir):
-        glob_string = os.path.join(panddaDir, 'processed_datasets', '*', '*.ccp4')
-    else:
-        glob_string = os.path.join(mydir, '*', '*event*.ccp4')
-
-    for maps in sorted(glob.glob(glob_string)):
-        tmp_map_name = None
-        sample_id = maps.split('/')[len(maps.split('/'))-2]
-        map_name = maps.split('/')[len(maps.split('/'))-1]
-        if checkOrder:
-            get_axis_order(map_name, maps)
-            break
-        if sample_id not in sampleList:
-            print('converting maps for {0!s}'.format(sample_id))
-            sampleList.append(sample_id)
-        workDir = maps[:maps.rfind('/')]
-        os.chdir(workDir)
-        pandda_input_mtz = '{0!s}-pandda-input.mtz'.format(sample_id)
-        if os.path.isfile(pandda_input_mtz):
-            dmin = get_resolution(pandda_input_mtz)
-        else:
-            print('ERROR: {0!s} does not exist; cannot get resolution of map later; skipping...'.format(pandda_input_mtz))
-            sys.exit(2)
-        print('current map {0!s}'.format(map_name))
-        mtz_name = map_name.replace('.ccp4', '.mtz')
-        if os.path.isfile(mtz_name) and not overwrite:
-            print('WARNING: {0!s} exists; skipping...'.format(mtz_name))
-            continue
-        if axisOrder:
-            tmp_map_name = map_name.replace('.ccp4', '_tmp.ccp4')
-            map_name = change_axis_order(map_name, tmp_map_name, axisOrder)
+def get_manifest_entry(maps, settings):
+    st = os.stat(maps)
+    entry = {'size': st.st_size, 'mtime': st.st_mtime, 'checksum': get_checksum(maps)}
+    entry.update(settings)
+    return entry
+
+def is_up_to_date(maps, settings, previous):
+    # size and mtime are enough if they did not change; otherwise the checksum decides, e.g. if the map
+    # was only copied or touched
+    if not previous or [previous.get(k) for k in settings] != [settings[k] for k in settings]:
+        return False, None
+    st = os.stat(maps)
+    if [previous['size'], previous['mtime']] == [st.st_size, st.st_mtime]:
+        return True, previous
+    entry = get_manifest_entry(maps, settings)
+    return entry['checksum'] == previous['checksum'], entry
+
+
+def convert_map(job):
+    # converts a single map; returns (map, status, message, seconds, manifest entry) instead of raising,
+    # so that one bad dataset does not stop the whole run
+    maps, dmin, axisOrder, overwrite, incremental, cinvfft, previous = job
+    start = time.time()
+    sample_id = os.path.basename(os.path.dirname(maps))
+    map_name = os.path.basename(maps)
+    pandda_input_mtz = os.path.join(os.path.dirname(maps), '{0!s}-pandda-input.mtz'.format(sample_id))
+    mtz_name = maps.replace('.ccp4', '.mtz')
+    settings = {'dmin': dmin, 'engine': 'cinvfft' if cinvfft else 'gemmi', 'axis': axisOrder if cinvfft else None}
+    if os.path.isfile(mtz_name) and not overwrite:
+        if not incremental:
+            return maps, 'skipped', '{0!s} exists'.format(mtz_name), time.time() - start, previous
+        up_to_date, entry = is_up_to_date(maps, settings, previous)
+        if up_to_date:
+            return maps, 'skipped', '{0!s} is up to date'.format(mtz_name), time.time() - start, entry
+    if not os.path.isfile(pandda_input_mtz):
+        return maps, 'failed', '{0!s} does not exist; cannot get resolution of map'.format(pandda_input_mtz), \
+               time.time() - start, None
+    # the temporary folder is on the same file system as the mtz file, so that the new file replaces an
+    # existing one in a single rename and readers never see a partly written mtz file
+    tmpDir = tempfile.mkdtemp(prefix='.convert_event_map_', dir=os.path.dirname(mtz_name))
+    try:
+        tmp_mtz = os.path.join(tmpDir, os.path.basename(mtz_name))
         if cinvfft:
-            run_cinvfft(map_name, pandda_input_mtz, mtz_name)
+            map_in = maps
+            if axisOrder:
+                map_in = change_axis_order(maps, os.path.join(tmpDir, map_name), axisOrder)
+            run_cinvfft(map_in, pandda_input_mtz, tmp_mtz, get_columns(map_name), tmpDir)
         else:
-            run_gemmi_map2sf(map_name, mtz_name, dmin)
-        if tmp_map_name:
-            remove_temp_map(tmp_map_name)
+            # gemmi takes care of the axis order
+            run_gemmi_map2sf(maps, tmp_mtz, dmin, get_columns(map_name))
+        if not os.path.isfile(tmp_mtz):
+            return maps, 'failed', '{0!s} was not created'.format(mtz_name), time.time() - start, None
+        if os.name == 'nt' and os.path.isfile(mtz_name):
+            os.remove(mtz_name)
+        os.rename(tmp_mtz, mtz_name)
+        entry = get_manifest_entry(maps, settings)
+    except Exception as e:
+        return maps, 'failed', str(e), time.time() - start, None
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+    return maps, 'converted', mtz_name, time.time() - start, entry
+
+
+def convert_event_maps_to_mtz(panddaDir, mydir, mapFile, axisOrder, overwrite, incremental, checkOrder, cinvfft,
+                              jobs):
+    if mapFile:
+        # single map, e.g. when called by inspect_pandda_analyse.py
+        glob_string = os.path.join(os.path.dirname(os.path.dirname(mapFile)), '*', '*.ccp4')
+        mapList = [mapFile]
+    else:
+        print('>>> looking for event maps in {0!s}'.format(panddaDir))
+        if os.path.isdir(panddaDir):
+            glob_string = os.path.join(panddaDir, 'processed_datasets', '*', '*.ccp4')
+        else:
+            glob_string = os.path.join(mydir, '*', '*event*.ccp4')
+        mapList = sorted(glob.glob(glob_string))
+    if checkOrder:
+        if mapList:
+            get_axis_order(os.path.basename(mapList[0]), mapList[0])
+        return 0
+
+    print('>>> converting {0!s} maps with {1!s} parallel job(s)'.format(len(mapList), jobs))
+    start = time.time()
+    # the resolution of every dataset is read only once and kept in a small cache file for the next run
+    cache_file = os.path.join(os.path.dirname(os.path.dirname(glob_string)), 'convert_event_map_to_mtz.json')
+    cache = read_cache(cache_file)
+    resolution_cache = cache.setdefault('resolution', {})
+    # source map size, mtime and checksum and the conversion settings of every MTZ file that was created
+    manifest = cache.setdefault('maps', {})
+    jobList = []
+    for sampleDir, sampleMaps in itertools.groupby(mapList, key=os.path.dirname):
+        sampleMaps = list(sampleMaps)
+        sample_id = os.path.basename(sampleDir)
+        pandda_input_mtz = os.path.join(sampleDir, '{0!s}-pandda-input.mtz'.format(sample_id))
+        dmin = None
+        if os.path.isfile(pandda_input_mtz) and \
+                (overwrite or incremental or [m for m in sampleMaps if not os.path.isfile(m.replace('.ccp4', '.mtz'))]):
+            dmin = get_cached_resolution(resolution_cache, pandda_input_mtz)
+        for maps in sampleMaps:
+            jobList.append((maps, dmin, axisOrder, overwrite, incremental, cinvfft,
+                            manifest.get(maps.replace('.ccp4', '.mtz'))))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(convert_map, jobList)
+    else:
+        pool = None
+        results = (convert_map(job) for job in jobList)
+
+    summary = {'converted': 0, 'skipped': 0, 'failed': 0}
+    failed = []
+    for n, (maps, status, message, seconds, entry) in enumerate(results):
+        summary[status] += 1
+        if entry:
+            manifest[maps.replace('.ccp4', '.mtz')] = entry
+        print('[{0!s}/{1!s}] {2!s} {3!s} ({4:.1f}s)'.format(n + 1, len(jobList), status, maps, seconds))
+        if status == 'failed':
+            print('ERROR: {0!s}'.format(message))
+            failed.append([maps, message])
+    if pool:
+        pool.close()
+        pool.join()
+    write_cache(cache_file, cache)
+
+    print('\n>>> converted: {0!s} - skipped: {1!s} - failed: {2!s} - total time: {3:.1f}s'.format(
+        summary['converted'], summary['skipped'], summary['failed'], time.time() - start))
+    for maps, message in failed:
+        print('failed: {0!s} -> {1!s}'.format(maps, message))
+    if failed:
+        return 1
+    return 0
 
 
 def usage():
@@ -165,28 +295,39 @@ def usage():
         'additional command line options:\n'
         '--mydir, -m DIRECTORY\n'
         '    can be any directory with subfolders containing event maps\n'
+        '--map, -f MAP\n'
+        '    converts only the given map\n'
         '--axis, -a AXIS_ORDER\n'
-        '    changes axis order of input map as specified, e.g. -a xyz\n'
+        '    changes axis order of input map as specified, e.g. -a xyz (only used with --cinvfft,\n'
+        '    gemmi reorders the axes itself)\n'
         '--checkaxis, -c\n'
         '    reports axis order of input maps\n'
         '--overwrite, -o\n'
         '    flag to overwrite existing mtz files\n'
+        '--incremental, -i\n'
+        '    only convert maps that changed, or whose conversion settings changed, since the\n'
+        '    existing mtz file was created (mtz files created by older versions are converted again)\n'
         '--cinvfft, -n\n'
         '    use cinvfft for map to mtz conversion instead of gemmi\n'
+        '--jobs, -j N\n'
+        '    number of maps that are converted in parallel (default: 1)\n'
     )
     print(usage)
 
 def main(argv):
     panddaDir = ''
     mydir = ''
+    mapFile = ''
     axisOrder = None
     checkOrder = False
     overwrite = False
+    incremental = False
     cinvfft = False
+    jobs = 1
 
     try:
-        opts, args = getopt.getopt(argv,"p:a:m:hocn",["panddadir=", "axis=", "mydir=",
-                                                      "overwrite", "checkaxis", "cinvfft"])
+        opts, args = getopt.getopt(argv,"p:a:m:f:j:hoicn",["panddadir=", "axis=", "mydir=", "map=", "jobs=",
+                                                      "overwrite", "incremental", "checkaxis", "cinvfft"])
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -199,26 +340,39 @@ def main(argv):
             panddaDir = os.path.abspath(arg)
         elif opt in ("-m", "--mydir"):
             mydir = os.path.abspath(arg)
+        elif opt in ("-f", "--map"):
+            mapFile = os.path.abspath(arg)
         elif opt in ("-a", "--axis"):
             axisOrder = arg
         elif opt in ("-c", "--checkaxis"):
             checkOrder = True
         elif opt in ("-o", "--overwrite"):
             overwrite = True
+        elif opt in ("-i", "--incremental"):
+            incremental = True
         elif opt in ("-n", "--cinvfft"):
             cinvfft = True
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
+
+    if axisOrder and len(axisOrder) != 3:
+        print('ERROR: axis order needs to contain three characters of type X, Y and Z')
+        sys.exit(2)
 
 #    print('-> pandda dir: {0!s}'.format(panddaDir))
 #    print('-> my dir: {0!s}'.format(mydir))
 
-    if os.path.isdir(panddaDir) or os.path.isdir(mydir):
-        convert_event_maps_to_mtz(panddaDir, mydir, axisOrder, overwrite, checkOrder, cinvfft)
+    if os.path.isdir(panddaDir) or os.path.isdir(mydir) or os.path.isfile(mapFile):
+        sys.exit(convert_event_maps_to_mtz(panddaDir, mydir, mapFile, axisOrder, overwrite, incremental, checkOrder,
+                                           cinvfft, jobs))
 #    elif os.path.isdir(mydir):
 #        convert_event_maps_to_mtz(panddaDir, mydir, axisOrder, overwrite, checkOrder)
     else:
-        print('ERROR: pandda directory or my directory does not exist')
+        print('ERROR: pandda directory, my directory or map does not exist')
         print('       pandda directory: {0!s}'.format(panddaDir))
         print('       my directory: {0!s}'.format(mydir))
+        print('       map: {0!s}'.format(mapFile))
+        sys.exit(2)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
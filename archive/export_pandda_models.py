@@ -23,8 +23,41 @@ import glob
 import sys
 import os
 import csv
+import shutil
+import time
+import traceback
+import subprocess
+import multiprocessing
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 from tabulate import tabulate
 import gemmi
+import numpy
+
+
+# column name -> labels in pandda_inspect_events.csv
+columns = [
+    ('dtag', ['dtag']),
+    ('event', ['event_num', 'event_idx']),
+    ('site', ['site_num', 'site_idx']),
+    ('bdc', ['bdc', '1-BDC']),
+    ('x', ['x']),
+    ('y', ['y']),
+    ('z', ['z']),
+    ('ligand_confidence', ['Ligand Confidence'])
+]
+
+# events further away from the centre of mass of all ligands are not assigned to a ligand (in Angstrom)
+max_ligand_distance = 8
+
+# ioctl_ficlone(2)
+FICLONE = 0x40049409
 
 
 def read_inspect_event_csv_as_list(panddaDir):
@@ -32,57 +65,71 @@ def read_inspect_event_csv_as_list(panddaDir):
     if not os.path.isfile(inspect_csv):
         print('ERROR: cannot find {0!s}'.format(inspect_csv))
         sys.exit(2)
-    print('reading {0!s}'.format)
+    print('reading {0!s}'.format(inspect_csv))
     r = csv.reader(open(inspect_csv))
     return list(r)
 
 
-def get_ligand_confidence_index(inspect_csv):
-    ligand_confidence_index = 0
-    for n, item in enumerate(inspect_csv[0]):  # number of columns at the end can differ
-        if item == 'Ligand Confidence':
-            ligand_confidence_index = n
-            break
-    return ligand_confidence_index
+def get_column_index(header):
+    # position of the columns in the CSV file; PanDDA1 and PanDDA2 use different names and orders
+    column_index = {}
+    missing = []
+    for name, labels in columns:
+        for label in labels:
+            if label in header:
+                column_index[name] = header.index(label)
+                break
+        if name not in column_index:
+            missing.append(' or '.join(labels))
+    if missing:
+        print('ERROR: missing column(s) in pandda_inspect_events.csv: {0!s}'.format(', '.join(missing)))
+        sys.exit(2)
+    return column_index
 
 
-def get_info(inspect_csv, sample_id, ligand_confidence_index, model):
+def get_info(events, column_index, model):
     ligand_confidence_list = []
     table = []
     header = ['Event', 'Site', 'BDC', 'Ligand ID', 'Distance', 'Ligand confidence']
-    for item in inspect_csv:
-        if item[0] == sample_id:
-            event = gemmi.Position(float(item[12]), float(item[13]), float(item[14]))
-            ligand, distance = assign_modelled_ligand_to_event_coordinate(model, event)
-            table.append([item[1], item[11], item[2], ligand, distance, item[ligand_confidence_index]])
-            if item[ligand_confidence_index] not in ligand_confidence_list:
-                ligand_confidence_list.append(item[ligand_confidence_index])
+    ligands, centres = get_ligands_in_model(model)
+    coordinates = numpy.array([[float(item[column_index[c]]) for c in ('x', 'y', 'z')] for item in events],
+                              dtype=float).reshape(-1, 3)
+    # distances of all events of the sample to all ligands (events x ligands)
+    distances = numpy.sqrt(((coordinates[:, numpy.newaxis, :] - centres[numpy.newaxis, :, :]) ** 2).sum(axis=2))
+    for n, item in enumerate(events):
+        ligand = 'unknown'
+        distance = 'unknown'
+        if ligands:
+            closest = int(numpy.argmin(distances[n]))
+            if distances[n, closest] < max_ligand_distance:
+                ligand = ligands[closest]
+                distance = str(round(float(distances[n, closest]), 2))
+        confidence = item[column_index['ligand_confidence']]
+        table.append([item[column_index['event']], item[column_index['site']], item[column_index['bdc']],
+                      ligand, distance, confidence])
+        if confidence not in ligand_confidence_list:
+            ligand_confidence_list.append(confidence)
     print(tabulate(table, headers=header))
     print("\n")
     return ligand_confidence_list
 
 
-def assign_modelled_ligand_to_event_coordinate(model, event):
-    lig = "unknown"
-    dis = "unknown"
+def get_ligands_in_model(model):
+    # IDs and centres of mass of all LIG residues in the model
+    ligands = []
+    centres = []
     structure = gemmi.read_structure(model, merge_chain_parts=True)
     for mod in structure:
         for chain in mod:
             for residue in chain:
                 if residue.name == 'LIG':
-                    c = gemmi.Chain(chain.name)
-                    c.add_residue(residue, 0)
-                    distance = round(event.dist(c.calculate_center_of_mass()), 2)
-#                    lig = residue.name + '-' + chain.name + '-' + str(residue.seqid.num)
-#                    print(lig, distance)
-#                    print(distance, event.tolist(), c.calculate_center_of_mass().tolist())
-                    if distance < 8:
-                        lig = residue.name + '-' + chain.name + '-' + str(residue.seqid.num)
-                        dis = distance
-#                    else:
-#                        lig = "unknown"
-#                        dis = "unknown"
-    return lig, str(dis)
+                    weights = numpy.array([atom.element.weight * atom.occ for atom in residue])
+                    if not weights.sum():
+                        continue
+                    xyz = numpy.array([atom.pos.tolist() for atom in residue])
+                    ligands.append(residue.name + '-' + chain.name + '-' + str(residue.seqid.num))
+                    centres.append(numpy.dot(weights, xyz) / weights.sum())
+    return ligands, numpy.array(centres, dtype=float).reshape(-1, 3)
 
 
 #def items_to_check():
@@ -93,23 +140,28 @@ def assign_modelled_ligand_to_event_coordinate(model, event):
 #    number_of_low_confidence_ligands = 0
 
 
-def run_giant_merge_conformations(sample_id):
-    cmd = (
-        'giant.merge_conformations '
-        ' major={0!s}-pandda-input.pdb '.format(sample_id) +
-        ' minor=modelled_structures/{0!s}-pandda-model.pdb '.format(sample_id) +
-        ' > /dev/null'
-    )
-    os.system(cmd)
+def run_command(cmd, cwd=None):
+    # output of the command is only shown if it fails
+    p = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = p.communicate()[0]
+    if p.returncode != 0:
+        raise RuntimeError('{0!s} failed with exit code {1!s}:\n{2!s}'.format(
+            ' '.join(cmd), p.returncode, out.decode('utf-8', 'replace') if out else ''))
+
+
+def run_giant_merge_conformations(sampleDir, sample_id):
+    run_command(['giant.merge_conformations',
+                 'major={0!s}-pandda-input.pdb'.format(sample_id),
+                 'minor=modelled_structures/{0!s}-pandda-model.pdb'.format(sample_id)], cwd=sampleDir)
 
 def prepare_model(panddaDir, sample_id, ensembleOnly, overwrite):
     print("--> ensemble model preparation")
     if ensembleOnly:
-        os.chdir(os.path.join(panddaDir, 'processed_datasets', sample_id))
-        if not os.path.isfile("multi-state-model.pdb"):
-            run_giant_merge_conformations(sample_id)
-        elif os.path.isfile("multi-state-model.pdb") and overwrite:
-            run_giant_merge_conformations(sample_id)
+        sampleDir = os.path.join(panddaDir, 'processed_datasets', sample_id)
+        if not os.path.isfile(os.path.join(sampleDir, "multi-state-model.pdb")):
+            run_giant_merge_conformations(sampleDir, sample_id)
+        elif overwrite:
+            run_giant_merge_conformations(sampleDir, sample_id)
         else:
             print('Warning: file exists (select -o option if you want to overwrite); skipping...')
     else:
@@ -127,107 +179,231 @@ def files_to_delete():
              ]
     return files
 
-def prepare_destination_dir(destinationDir, sample_id, overwrite):
+def prepare_destination_dir(destinationDir, sample_id, overwrite, keep):
+    # files in keep are exported again and only replaced if they changed; all other exported files
+    # are removed when overwriting
     print("--> destination directory preparation")
     print("checking if sample folder exisits in {0!s}".format(destinationDir))
-    os.chdir(destinationDir)
-    if os.path.isdir(sample_id):
+    sampleDestinationDir = os.path.join(destinationDir, sample_id)
+    if os.path.isdir(sampleDestinationDir):
         print('sample directory exists; skipping...')
     else:
         print("creating sample directory")
-        os.mkdir(sample_id)
-    os.chdir(sample_id)
+        os.mkdir(sampleDestinationDir)
     if overwrite:
-        for f in glob.glob('event_*.native.mtz'):
-            print("removing " + f)
-            os.remove(f)
-        for f in files_to_delete():
-            if os.path.isfile(f):
+        for f in glob.glob(os.path.join(sampleDestinationDir, 'event_*.native.mtz')):
+            if os.path.basename(f) not in keep:
+                print("removing " + os.path.basename(f))
                 os.remove(f)
+        for f in files_to_delete():
+            if f not in keep and os.path.lexists(os.path.join(sampleDestinationDir, f)):
+                os.remove(os.path.join(sampleDestinationDir, f))
                 print("removing " + f)
 
 
-def linking_files_to_destination_dir(destinationDir, sample_id, panddaDir, ensembleOnly, model, overwrite):
+def is_up_to_date(source, destination):
+    # same size and modification time as the source; copies keep the mtime of the source
+    if not os.path.isfile(destination) or os.path.islink(destination):
+        return False
+    s = os.stat(source)
+    d = os.stat(destination)
+    return s.st_size == d.st_size and int(s.st_mtime) == int(d.st_mtime)
+
+
+def reflink(source, destination):
+    # copy-on-write clone of the file (btrfs, xfs, ...); only available on linux
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    with open(source, 'rb') as s:
+        with open(destination, 'wb') as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                return True
+            except (IOError, OSError):
+                pass
+    os.remove(destination)
+    return False
+
+
+def copy_file(source, destination):
+    if sys.version_info[0] >= 3:
+        # uses sendfile/ fcopyfile where available
+        shutil.copyfile(source, destination)
+    else:
+        with open(source, 'rb') as s:
+            with open(destination, 'wb') as d:
+                shutil.copyfileobj(s, d, 16 * 1024 * 1024)
+
+
+def transfer_file(source, destination, transfer):
+    # hardlink (if selected) or reflink first, otherwise copy; the file appears under its final name only
+    # when it is complete
+    if is_up_to_date(source, destination):
+        return 'skipped'
+    tmp = destination + '.part'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    status = None
+    if transfer == 'hardlink':
+        try:
+            os.link(source, tmp)
+            status = 'linked'
+        except OSError:
+            pass
+    if status is None and transfer in ('hardlink', 'reflink') and reflink(source, tmp):
+        status = 'copied'
+    if status is None:
+        copy_file(source, tmp)
+        status = 'copied'
+    if status == 'copied':
+        shutil.copystat(source, tmp)
+    if os.name == 'nt' and os.path.lexists(destination):
+        os.remove(destination)
+    os.rename(tmp, destination)
+    return status
+
+
+def symlink_file(source, destination):
+    target = os.path.relpath(source, os.path.dirname(destination))
+    if os.path.islink(destination) and os.readlink(destination) == target:
+        return 'skipped'
+    if os.path.lexists(destination):
+        os.remove(destination)
+    os.symlink(target, destination)
+    return 'linked'
+
+
+def files_to_export(sample_id, panddaDir, ensembleOnly, model):
+    # (source, name in destination folder, symlink) of all files that are exported for a sample
+    sampleDir = os.path.join(panddaDir, 'processed_datasets', sample_id)
+    files = []
+    if ensembleOnly:
+        for f in ['multi-state-model.pdb', 'multi-state-restraints.refmac.params',
+                  'multi-state-restraints.phenix.params']:
+            files.append((os.path.join(sampleDir, f), f, True))
+    else:
+        files.append((model, 'pandda-model.pdb', False))
+        files.append((os.path.join(sampleDir, sample_id + '-pandda-input.mtz'), 'pandda-model.mtz', False))
+    files.append((os.path.join(sampleDir, "{0!s}-ground-state-average-map.native.mtz".format(sample_id)),
+                  'ground-state-average-map.native.mtz', False))
+    files.append((os.path.join(sampleDir, "{0!s}-z_map.native.mtz".format(sample_id)), 'z_map.native.mtz', False))
+    for event in glob.glob(os.path.join(sampleDir, "{0!s}-event_*_map.native.mtz".format(sample_id))):
+        files.append((event, os.path.basename(event).replace(sample_id + '-', ''), False))
+    ligand_files = os.path.join(sampleDir, "ligand_files")
+    for root, dirs, names in os.walk(ligand_files):
+        for name in names:
+            source = os.path.join(root, name)
+            files.append((source, os.path.relpath(source, sampleDir), False))
+    return [f for f in files if os.path.isfile(f[0])]
+
+
+def linking_files_to_destination_dir(destinationDir, sample_id, files, transfer, overwrite):
+    # all paths are absolute, so that several samples can be exported at the same time
     if overwrite:
         print("--> linking files to destination directory")
-        os.chdir(os.path.join(destinationDir, sample_id))
-        if ensembleOnly:
-            if os.path.isfile(os.path.join(panddaDir, 'processed_datasets', sample_id,
-                                           'multi-state-model.pdb')):
-                os.system('ln -s {0!s}'.format(os.path.relpath(
-                    os.path.join(panddaDir, 'processed_datasets', sample_id, 'multi-state-model.pdb'))))
-            if os.path.isfile(os.path.join(panddaDir, 'processed_datasets', sample_id,
-                                           'multi-state-restraints.refmac.params')):
-                os.system('ln -s {0!s}'.format(os.path.relpath(
-                    os.path.join(panddaDir, 'processed_datasets', sample_id, 'multi-state-restraints.refmac.params'))))
-            if os.path.isfile(os.path.join(panddaDir, 'processed_datasets', sample_id,
-                                           'multi-state-restraints.phenix.params')):
-                os.system('ln -s {0!s}'.format(os.path.relpath(
-                    os.path.join(panddaDir, 'processed_datasets', sample_id, 'multi-state-restraints.phenix.params'))))
-        else:
-            print('preparing links for {0!s}'.format(sample_id))
-            if os.path.isfile(model):
-#                os.system('ln -s {0!s} pandda-model.pdb'.format(os.path.relpath(model)))
-                os.system('/bin/cp {0!s} pandda-model.pdb'.format(os.path.relpath(model)))
-            if os.path.isfile(os.path.join(panddaDir, 'processed_datasets', sample_id, sample_id + '-pandda-input.mtz')):
-                os.system('/bin/cp {0!s} pandda-model.mtz'.format(
-                    os.path.join(panddaDir, 'processed_datasets', sample_id, sample_id + '-pandda-input.mtz')))
-        if os.path.isfile(os.path.join(panddaDir, 'processed_datasets',
-                                       sample_id, "{0!s}-ground-state-average-map.native.mtz".format(sample_id))):
-            os.system('/bin/cp {0!s} ground-state-average-map.native.mtz'.format(os.path.join(
-                        panddaDir, 'processed_datasets',
-                        sample_id, "{0!s}-ground-state-average-map.native.mtz".format(sample_id))))
-#                os.system('ln -s {0!s} ground-state-average-map.native.mtz'.format(
-#                    os.path.relpath(os.path.join(
-#                        panddaDir, 'processed_datasets',
-#                        sample_id, "{0!s}-ground-state-average-map.native.mtz".format(sample_id)))))
-        if os.path.isfile(os.path.join(panddaDir, 'processed_datasets',
-                                       sample_id, "{0!s}-z_map.native.mtz".format(sample_id))):
-            os.system('/bin/cp {0!s} z_map.native.mtz'.format(os.path.join(panddaDir, 'processed_datasets',
-                                                 sample_id, "{0!s}-z_map.native.mtz".format(sample_id))))
-#                os.system('ln -s {0!s} z_map.native.mtz'.format(
-#                    os.path.relpath(os.path.join(panddaDir, 'processed_datasets',
-#                                                 sample_id, "{0!s}-z_map.native.mtz".format(sample_id)))))
-        for event in glob.glob(os.path.join(panddaDir, 'processed_datasets',
-                                            sample_id, "{0!s}-event_*_map.native.mtz".format(sample_id))):
-            filename = event[event.rfind('/')+1:]
-            new_filename = filename.replace(sample_id + '-', '')
-#            os.system('ln -s {0!s} {1!s}'.format(event, new_filename))
-            os.system('/bin/cp {0!s} {1!s}'.format(event, new_filename))
-        if os.path.isdir(os.path.join(panddaDir, 'processed_datasets',
-                                       sample_id, "ligand_files".format(sample_id))):
-            os.system('/bin/cp -R {0!s} .'.format(os.path.join(panddaDir, 'processed_datasets',
-                                       sample_id, "ligand_files".format(sample_id))))
-
-def export_pandda_models(panddaDir, destinationDir, export, highconfidenceOnly, lowconfidenceOnly, ensembleOnly, overwrite):
-    inspect_csv = read_inspect_event_csv_as_list(panddaDir)
-    ligand_confidence_index = get_ligand_confidence_index(inspect_csv)
-    for str in sorted(glob.glob(os.path.join(panddaDir, 'processed_datasets', '*',
-                                              'modelled_structures','*-pandda-model.pdb'))):
-        sample_id = str.split('/')[len(str.split('/'))-3]
-        print('{0!s}:\n'.format(sample_id))
+        sampleDestinationDir = os.path.join(destinationDir, sample_id)
+        summary = {'copied': 0, 'linked': 0, 'skipped': 0}
+        nbytes = 0
+        for source, name, symlink in files:
+            destination = os.path.join(sampleDestinationDir, name)
+            if not os.path.isdir(os.path.dirname(destination)):
+                os.makedirs(os.path.dirname(destination))
+            if symlink:
+                status = symlink_file(source, destination)
+            else:
+                status = transfer_file(source, destination, transfer)
+            summary[status] += 1
+            if status == 'copied':
+                nbytes += os.path.getsize(source)
+        print('copied: {0!s} ({1:.1f} MB) - linked: {2!s} - unchanged: {3!s}'.format(
+            summary['copied'], nbytes / 1048576.0, summary['linked'], summary['skipped']))
 
+def export_sample(job):
+    # exports a single sample; runs in a worker process when exporting in parallel, so everything that is
+    # printed is collected and shown by the main process once the sample is done
+    panddaDir, destinationDir, sample_id, model, events, column_index, export, highconfidenceOnly, \
+        lowconfidenceOnly, ensembleOnly, overwrite, transfer = job
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    status = 'analysed'
+    message = ''
+    try:
+        print('{0!s}:\n'.format(sample_id))
+        ligand_confidence_list = get_info(events, column_index, model)
         if export:
-            ligand_confidence_list = get_info(inspect_csv, sample_id, ligand_confidence_index, str)
+            selected = True
             if highconfidenceOnly:
                 print('--> exporting high confidence models only')
-                if "high confidence" in ligand_confidence_list:
-                    prepare_model(panddaDir, sample_id, ensembleOnly, overwrite)
-                    prepare_destination_dir(destinationDir, sample_id, overwrite)
-                    linking_files_to_destination_dir(destinationDir, sample_id, panddaDir, ensembleOnly, str, overwrite)
+                selected = "high confidence" in ligand_confidence_list
             elif lowconfidenceOnly:
                 print('--> exporting low confidence models only')
-                if "low confidence" in ligand_confidence_list and not "high confidence" in ligand_confidence_list:
-                    prepare_model(panddaDir, sample_id, ensembleOnly, overwrite)
-                    prepare_destination_dir(destinationDir, sample_id, overwrite)
-                    linking_files_to_destination_dir(destinationDir, sample_id, panddaDir, ensembleOnly, str, overwrite)
+                selected = "low confidence" in ligand_confidence_list and \
+                           not "high confidence" in ligand_confidence_list
             else:
                 print('--> exporting ALL available models')
+            if selected:
                 prepare_model(panddaDir, sample_id, ensembleOnly, overwrite)
-                prepare_destination_dir(destinationDir, sample_id, overwrite)
-                linking_files_to_destination_dir(destinationDir, sample_id, panddaDir, ensembleOnly, str, overwrite)
-        else:
-            ligand_confidence_list = get_info(inspect_csv, sample_id, ligand_confidence_index, str)
+                files = files_to_export(sample_id, panddaDir, ensembleOnly, model)
+                prepare_destination_dir(destinationDir, sample_id, overwrite, [f[1] for f in files])
+                linking_files_to_destination_dir(destinationDir, sample_id, files, transfer, overwrite)
+                status = 'exported'
+            else:
+                status = 'skipped'
+    except Exception as e:
+        status = 'failed'
+        message = '{0!s}: {1!s}'.format(type(e).__name__, e)
+        print(traceback.format_exc())
+    finally:
+        output = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return sample_id, status, message, output
+
+
+def export_pandda_models(panddaDir, destinationDir, export, highconfidenceOnly, lowconfidenceOnly, ensembleOnly,
+                         overwrite, jobs, transfer):
+    inspect_csv = read_inspect_event_csv_as_list(panddaDir)
+    column_index = get_column_index(inspect_csv[0])
+    if export:
+        destinationDir = os.path.abspath(destinationDir)
+    events_of_sample = {}
+    for item in inspect_csv[1:]:
+        events_of_sample.setdefault(item[column_index['dtag']], []).append(item)
+    jobList = []
+    for model in sorted(glob.glob(os.path.join(panddaDir, 'processed_datasets', '*',
+                                               'modelled_structures', '*-pandda-model.pdb'))):
+        sample_id = os.path.basename(os.path.dirname(os.path.dirname(model)))
+        jobList.append((panddaDir, destinationDir, sample_id, model, events_of_sample.get(sample_id, []),
+                        column_index, export, highconfidenceOnly, lowconfidenceOnly, ensembleOnly,
+                        overwrite, transfer))
+
+    print('>>> processing {0!s} models with {1!s} parallel job(s)'.format(len(jobList), jobs))
+    start = time.time()
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(export_sample, jobList)
+    else:
+        pool = None
+        results = (export_sample(job) for job in jobList)
+
+    summary = {'exported': 0, 'analysed': 0, 'skipped': 0, 'failed': 0}
+    failed = []
+    for n, (sample_id, status, message, output) in enumerate(results):
+        summary[status] += 1
+        print(output)
+        print('[{0!s}/{1!s}] {2!s} {3!s}\n'.format(n + 1, len(jobList), status, sample_id))
+        if status == 'failed':
+            failed.append([sample_id, message])
+    if pool:
+        pool.close()
+        pool.join()
+
+    print('>>> exported: {0!s} - analysed only: {1!s} - skipped: {2!s} - failed: {3!s} - total time: {4:.1f}s'.format(
+        summary['exported'], summary['analysed'], summary['skipped'], summary['failed'], time.time() - start))
+    for sample_id, message in failed:
+        print('failed: {0!s} -> {1!s}'.format(sample_id, message))
+    if failed:
+        return 1
+    return 0
 
 
 def usage():
@@ -258,6 +434,13 @@ def usage():
         '    Export models as ensample models (default is as single conformer models).\n'
         '--overwrite, -o\n'
         '    Flag to overwrite previously exported files.\n'
+        '--jobs, -j N\n'
+        '    Number of samples that are exported in parallel (default: 1).\n'
+        '--transfer, -t copy|reflink|hardlink\n'
+        '    How files are exported: reflinks (copy-on-write clones, e.g. on btrfs or xfs) fall back to\n'
+        '    copies; hardlinks share the file with the pandda folder, so changing an exported file in place\n'
+        '    changes the original (default: reflink). Files whose size and modification time did not\n'
+        '    change are not exported again.\n'
     )
     print(usage)
 
@@ -271,10 +454,13 @@ def main(argv):
     lowconfidenceOnly = False
     ensembleOnly = False
     overwrite = False
+    jobs = 1
+    transfer = 'reflink'
 
     try:
-        opts, args = getopt.getopt(argv,"p:d:henclo",["panddadir=", "destinationdir=", "export", "ensemble",
-                                                   "highconfidence", "lowconfidence", "overwrite"])
+        opts, args = getopt.getopt(argv,"p:d:j:t:henclo",["panddadir=", "destinationdir=", "jobs=", "transfer=",
+                                                       "export", "ensemble", "highconfidence", "lowconfidence",
+                                                       "overwrite"])
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -297,12 +483,20 @@ def main(argv):
             lowconfidenceOnly = True
         elif opt in ("-o", "--overwrite"):
             overwrite = True
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
+        elif opt in ("-t", "--transfer"):
+            transfer = arg
 
 
+    if transfer not in ('copy', 'reflink', 'hardlink'):
+        print('ERROR: transfer needs to be copy, reflink or hardlink')
+        sys.exit(2)
+
     try:
         if os.path.isdir(panddaDir):
-            export_pandda_models(panddaDir, destinationDir, export, highconfidenceOnly, lowconfidenceOnly,
-                                 ensembleOnly, overwrite)
+            sys.exit(export_pandda_models(panddaDir, destinationDir, export, highconfidenceOnly,
+                                          lowconfidenceOnly, ensembleOnly, overwrite, jobs, transfer))
         else:
             print('ERROR: pandda directory does not exist -> {0!s}'.format(panddaDir))
     except TypeError:
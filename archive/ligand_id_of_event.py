@@ -1,57 +1,282 @@
 import os
 import sys
+import csv
+import time
+import getopt
+import multiprocessing
 import gemmi
-import pandas as pd
 
-def get_ligands_in_structure(pdb, allowed_ligand_ids):
-    lig_dict = {}
+# ligands with atoms further away from the event are not assigned to it (in Angstrom)
+cutoff = 8.0
+
+result_columns = ['ligand_id', 'ligand_event_distance', 'ligands_within_cutoff']
+
+
+def get_ligands_in_structure(pdb, allowed_ligand_ids, cutoff):
+    # the model is read once per dataset; only ligand atoms end up in the neighbour search
     structure = gemmi.read_structure(pdb)
-    for model in structure:
-        for chain in model:
-            for residue in chain:
-                if residue.name in allowed_ligand_ids:
-                    c = gemmi.Chain(chain.name)
-                    c.add_residue(residue, 0)
-                    lig_name = str(residue.name)+'-'+str(chain.name)+'-'+ str(residue.seqid.num)
-                    lig_dict[lig_name] = c
-    return lig_dict
-
-def parse_pandda_analyse_events_csv(pandda_csv, pandda_dir, allowed_ligand_ids):
-    event_df = pd.read_csv(pandda_csv)
-    event_df['ligand_id'] = ""
-    event_df['ligand_event_distance'] = ""
-    for index, row in event_df.iterrows():
-        sample_id = row['dtag']
-        event_idx = row['event_idx']
-        site_idx = row['site_idx']
-        print('sample_id: {0!s} - event_idx: {1!s} - site_idx: {2!s}'.format(sample_id, event_idx, site_idx))
-        x_event = float(row['x'])
-        y_event = float(row['y'])
-        z_event = float(row['z'])
-        position_event = gemmi.Position(x_event, y_event, z_event)
-        lig_dist_list = []
-        pdb = os.path.join(pandda_dir, 'processed_datasets', sample_id, 'modelled_structures',
-                           sample_id + '-pandda-model.pdb')
-        if os.path.isfile(pdb):
-            print('found pdb file')
-            lig_dict = get_ligands_in_structure(pdb, allowed_ligand_ids)
-            if lig_dict:
-                for ligand in lig_dict:
-                    c = lig_dict[ligand]
-                    position_ligand = c.calculate_center_of_mass()
-                    event_ligand_distance = position_event.dist(position_ligand)
-                    lig_dist_list.append([ligand, event_ligand_distance])
-                if lig_dist_list:
-                    ligand_id_close_to_event = min(lig_dist_list, key=lambda x: x[1])[0]
-                    ligand_event_distance = min(lig_dist_list, key=lambda x: x[1])[1]
-                    event_df.at[index, 'ligand_id'] =ligand_id_close_to_event
-                    event_df.at[index, 'ligand_event_distance'] =ligand_event_distance
-                    print('closest distance of ligand {0!s} to event is {1!s}'.format(ligand_id_close_to_event,
-                                                                                      ligand_event_distance))
-    event_df.to_csv('pandda_analyse_events_with_ligand_ids.csv')
+    ligands = structure[0]
+    for chain in ligands:
+        for n in reversed(range(len(chain))):
+            if chain[n].name not in allowed_ligand_ids:
+                del chain[n]
+    structure.remove_empty_chains()
+    if not len(ligands):
+        return None, None
+    ns = gemmi.NeighborSearch(ligands, structure.cell, cutoff).populate()
+    return structure, ns
+
+
+def ligands_close_to_event(ligands, ns, position_event, cutoff):
+    # shortest distance of any atom of each ligand to the event; only the atoms within the cutoff are checked
+    distances = {}
+    for mark in ns.find_atoms(position_event, '\0', radius=cutoff):
+        cra = mark.to_cra(ligands)
+        distance = position_event.dist(cra.atom.pos)
+        if distance <= cutoff:
+            lig_name = str(cra.residue.name) + '-' + str(cra.chain.name) + '-' + str(cra.residue.seqid.num)
+            if lig_name not in distances or distance < distances[lig_name]:
+                distances[lig_name] = distance
+    return sorted(distances.items(), key=lambda x: x[1])
+
+
+def assign_ligands_to_events(events, pdb, allowed_ligand_ids, cutoff):
+    # ligand ID, distance and all ligands within the cutoff for each event of a dataset
+    assigned = [['', '', ''] for event in events]
+    if not os.path.isfile(pdb):
+        return assigned
+    structure, ns = get_ligands_in_structure(pdb, allowed_ligand_ids, cutoff)
+    if structure is None:
+        return assigned
+    for n, (x, y, z) in enumerate(events):
+        close = ligands_close_to_event(structure[0], ns, gemmi.Position(x, y, z), cutoff)
+        if close:
+            ligand_id_close_to_event, ligand_event_distance = close[0]
+            assigned[n] = [ligand_id_close_to_event, round(ligand_event_distance, 2),
+                           ';'.join('{0!s}:{1:.2f}'.format(l, d) for l, d in close)]
+    return assigned
+
+
+def assign_dataset(job):
+    # runs in a worker process when several datasets are processed in parallel
+    sample_id, pdb, rows, position, allowed_ligand_ids, cutoff = job
+    try:
+        events = [[float(row[position[c]]) for c in ('x', 'y', 'z')] for row in rows]
+        assigned = assign_ligands_to_events(events, pdb, allowed_ligand_ids, cutoff)
+    except Exception as e:
+        # no rows are returned, so that the dataset is not written and is tried again when the run is resumed
+        return sample_id, [], '{0!s}: {1!s}'.format(type(e).__name__, e)
+    return sample_id, [row + a for row, a in zip(rows, assigned)], ''
+
+
+def read_events(pandda_csv):
+    # header and events of each dataset in the order of the CSV file; the line number is kept as first
+    # column, as in earlier versions of the output file
+    events_of_dataset = {}
+    datasets = []
+    with open(pandda_csv) as f:
+        r = csv.reader(f)
+        header = next(r)
+        if 'dtag' not in header:
+            return None, [], {}
+        d = header.index('dtag')
+        for n, row in enumerate(r):
+            if not row:
+                continue
+            if row[d] not in events_of_dataset:
+                events_of_dataset[row[d]] = []
+                datasets.append(row[d])
+            events_of_dataset[row[d]].append([str(n)] + row)
+    return [''] + header, datasets, events_of_dataset
+
+
+def replace_output(output_csv, header, rows):
+    # the file is written next to the output file and then moved into place, so that it is never half written
+    tmp = output_csv + '.tmp'
+    with open(tmp, 'w') as f:
+        w = csv.writer(f)
+        w.writerow(header + result_columns)
+        w.writerows(rows)
+    if os.name == 'nt' and os.path.isfile(output_csv):
+        os.remove(output_csv)
+    os.rename(tmp, output_csv)
+
+
+def sort_output(output_csv, header):
+    # datasets are appended in the order in which they finish, and datasets that are added when a run is
+    # resumed end up at the end of the file; this puts all events back into the order of pandda_analyse_events.csv, i.e. by the line number in the first column
+    with open(output_csv) as f:
+        r = csv.reader(f)
+        next(r)
+        rows = [row for row in r if row]
+    rows.sort(key=lambda row: int(row[0]))
+    replace_output(output_csv, header, rows)
+
+
+def read_finished_datasets(output_csv, header, events_of_dataset):
+    # datasets that are complete in the output file of an earlier run; everything else (e.g. lines of
+    # a dataset that was written when the run was stopped) is removed from the file
+    finished = set()
+    rows = []
+    d = header.index('dtag')
+    with open(output_csv) as f:
+        r = csv.reader(f)
+        if next(r, None) != header + result_columns:
+            return None
+        for row in r:
+            if len(row) == len(header) + len(result_columns) and row[d] in events_of_dataset:
+                rows.append(row)
+    count = {}
+    for row in rows:
+        count[row[d]] = count.get(row[d], 0) + 1
+    for sample_id in count:
+        if count[sample_id] == len(events_of_dataset[sample_id]):
+            finished.add(sample_id)
+    replace_output(output_csv, header, [row for row in rows if row[d] in finished])
+    return finished
+
+
+def parse_pandda_analyse_events_csv(pandda_csv, pandda_dir, allowed_ligand_ids, cutoff, output_csv, overwrite,
+                                    jobs):
+    header, datasets, events_of_dataset = read_events(pandda_csv)
+    position = {}
+    for c in ('dtag', 'x', 'y', 'z'):
+        if header is None or c not in header:
+            print('ERROR: cannot find column {0!s} in {1!s}'.format(c, pandda_csv))
+            return 2
+        position[c] = header.index(c)
+
+    finished = set()
+    if os.path.isfile(output_csv) and not overwrite:
+        finished = read_finished_datasets(output_csv, header, events_of_dataset)
+        if finished is None:
+            print('ERROR: {0!s} was not created from {1!s}; use --overwrite to replace it'.format(
+                output_csv, pandda_csv))
+            return 2
+        print('>>> resuming: {0!s} of {1!s} datasets are already in {2!s}'.format(
+            len(finished), len(datasets), output_csv))
+    else:
+        with open(output_csv, 'w') as f:
+            csv.writer(f).writerow(header + result_columns)
+
+    jobList = []
+    for sample_id in datasets:
+        if sample_id not in finished:
+            pdb = os.path.join(pandda_dir, 'processed_datasets', sample_id, 'modelled_structures',
+                               sample_id + '-pandda-model.pdb')
+            jobList.append((sample_id, pdb, events_of_dataset[sample_id], position, allowed_ligand_ids, cutoff))
+
+    print('>>> assigning ligands {0!s} to events of {1!s} datasets with {2!s} parallel job(s)'.format(
+        ', '.join(allowed_ligand_ids), len(jobList), jobs))
+    start = time.time()
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        # datasets are written in the order in which they finish and sorted at the end
+        results = pool.imap_unordered(assign_dataset, jobList)
+    else:
+        pool = None
+        results = (assign_dataset(job) for job in jobList)
+
+    failed = []
+    # every dataset is written as soon as it is done, so that a run that was stopped can be resumed
+    with open(output_csv, 'a') as f:
+        w = csv.writer(f)
+        for n, (sample_id, rows, message) in enumerate(results):
+            if message:
+                print('[{0!s}/{1!s}] ERROR: {2!s} -> {3!s}'.format(n + 1, len(jobList), sample_id, message))
+                failed.append(sample_id)
+                continue
+            w.writerows(rows)
+            f.flush()
+            assigned = len([row for row in rows if row[-3]])
+            print('[{0!s}/{1!s}] {2!s}: {3!s} of {4!s} events assigned to a ligand'.format(
+                n + 1, len(jobList), sample_id, assigned, len(rows)))
+    if pool:
+        pool.close()
+        pool.join()
+    if jobList and (finished or jobs > 1):
+        sort_output(output_csv, header)
+    print('>>> wrote {0!s} in {1:.1f}s'.format(output_csv, time.time() - start))
+    if failed:
+        print('>>> datasets with errors: {0!s}; they are not in the output file and are tried again when the '
+              'run is resumed'.format(', '.join(failed)))
+        return 1
+    return 0
+
+
+def usage():
+    usage = (
+        '\n'
+        'ligand_id_of_event.py assigns the modelled ligands to the events in pandda_analyse_events.csv\n'
+        '\n'
+        'usage:\n'
+        'ccp4-python ligand_id_of_event.py -p <pandda_dir>\n'
+        'e.g.\n'
+        'ccp4-python ligand_id_of_event.py -p /data/user/pandda -l LIG,DRG -j 8\n'
+        '\n'
+        'additional command line options:\n'
+        '--ligands, -l ID[,ID...]\n'
+        '    residue names of the ligands (default: LIG,DRG)\n'
+        '--cutoff, -c DISTANCE\n'
+        '    largest distance of a ligand atom to the event in Angstrom (default: 8.0)\n'
+        '--output, -o FILE\n'
+        '    output CSV file (default: pandda_analyse_events_with_ligand_ids.csv); if the file\n'
+        '    exists, datasets that are already in it are skipped\n'
+        '--overwrite\n'
+        '    starts again instead of resuming an existing output file\n'
+        '--jobs, -j N\n'
+        '    number of datasets that are processed in parallel (default: 1)\n'
+    )
+    print(usage)
+
+
+def main(argv):
+    pandda_dir = ''
+    allowed_ligand_ids = ['LIG', 'DRG']
+    max_distance = cutoff
+    output_csv = 'pandda_analyse_events_with_ligand_ids.csv'
+    overwrite = False
+    jobs = 1
+
+    try:
+        opts, args = getopt.gnu_getopt(argv, "p:l:c:o:j:h", ["panddadir=", "ligands=", "cutoff=", "output=",
+                                                           "jobs=", "overwrite"])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt in ("-p", "--panddadir"):
+            pandda_dir = os.path.abspath(arg)
+        elif opt in ("-l", "--ligands"):
+            allowed_ligand_ids = [l.strip() for l in arg.split(',') if l.strip()]
+        elif opt in ("-c", "--cutoff"):
+            max_distance = float(arg)
+        elif opt in ("-o", "--output"):
+            output_csv = os.path.abspath(arg)
+        elif opt == "--overwrite":
+            overwrite = True
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
+
+    # pandda directory as only argument, as in earlier versions
+    if not pandda_dir and args:
+        pandda_dir = os.path.abspath(args[0])
 
-if __name__ == '__main__':
-    allowed_ligand_ids = ['LIG, DRG']
-    pandda_dir = sys.argv[1]
     pandda_csv = os.path.join(pandda_dir, 'analyses', 'pandda_analyse_events.csv')
-    parse_pandda_analyse_events_csv(pandda_csv, pandda_dir, allowed_ligand_ids)
\ No newline at end of file
+    if not pandda_dir or not os.path.isfile(pandda_csv):
+        print('ERROR: cannot find pandda_analyse_events.csv in pandda directory: {0!s}'.format(pandda_dir))
+        usage()
+        sys.exit(2)
+    if not allowed_ligand_ids:
+        print('ERROR: no ligand IDs given')
+        sys.exit(2)
+    sys.exit(parse_pandda_analyse_events_csv(pandda_csv, pandda_dir, allowed_ligand_ids, max_distance, output_csv,
+                                             overwrite, jobs))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,253 @@
+# Copyright (c) 2022, Tobias Krojer, MAX IV Laboratory
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import getopt
+import sys
+import os
+import csv
+import random
+import shutil
+import tempfile
+import time
+
+try:
+    import gemmi
+except ImportError:
+    gemmi = None
+
+pandda1_header = ['dtag', 'event_idx', 'site_idx', '1-BDC', 'z_peak', 'z_mean', 'cluster_size', 'x', 'y', 'z',
+                  'refx', 'refy', 'refz', 'analysed_resolution', 'map_uncertainty', 'r_work', 'r_free']
+
+pandda2_header = ['dtag', 'event_idx', 'site_idx', 'bdc', 'cluster_size', 'x', 'y', 'z', 'z_peak', 'z_mean',
+                  'high_resolution', 'r_work', 'r_free']
+
+pdb_template = (
+    'CRYST1   20.000   20.000   20.000  90.00  90.00  90.00 P 1\n'
+    'ATOM      1  N   GLY A   1       1.000   1.000   1.000  1.00 20.00           N\n'
+    'ATOM      2  CA  GLY A   1       2.400   1.000   1.000  1.00 20.00           C\n'
+    'ATOM      3  C   GLY A   1       3.000   2.400   1.000  1.00 20.00           C\n'
+    'ATOM      4  O   GLY A   1       2.300   3.400   1.000  1.00 20.00           O\n'
+    'END\n'
+)
+
+ligand_pdb_template = (
+    'HETATM    1  C1  LIG X   1       5.000   5.000   5.000  1.00 20.00           C\n'
+    'HETATM    2  O1  LIG X   1       6.200   5.000   5.000  1.00 20.00           O\n'
+    'END\n'
+)
+
+ligand_cif_template = (
+    'data_comp_list\n'
+    'loop_\n'
+    '_chem_comp.id\n'
+    '_chem_comp.three_letter_code\n'
+    '_chem_comp.name\n'
+    '_chem_comp.group\n'
+    '_chem_comp.number_atoms_all\n'
+    '_chem_comp.number_atoms_nh\n'
+    '_chem_comp.desc_level\n'
+    'LIG LIG "synthetic ligand" NON-POLYMER 2 2 .\n'
+)
+
+
+def make_templates(templateDir):
+    # every dataset gets copies of the same small files; real map and MTZ files are only written if
+    # gemmi is available, otherwise the files only have the right names
+    templates = {
+        'pdb': os.path.join(templateDir, 'template.pdb'),
+        'ligand_pdb': os.path.join(templateDir, 'template-ligand.pdb'),
+        'ligand_cif': os.path.join(templateDir, 'template-ligand.cif'),
+        'ccp4': os.path.join(templateDir, 'template.ccp4'),
+        'mtz': os.path.join(templateDir, 'template.mtz')
+    }
+    for key, text in [('pdb', pdb_template), ('ligand_pdb', ligand_pdb_template),
+                      ('ligand_cif', ligand_cif_template)]:
+        with open(templates[key], 'w') as f:
+            f.write(text)
+    if gemmi is None:
+        for key in ('ccp4', 'mtz'):
+            with open(templates[key], 'wb') as f:
+                f.write(b'\0' * 1024)
+        return templates
+    grid = gemmi.FloatGrid(8, 8, 8)
+    grid.set_unit_cell(gemmi.UnitCell(20, 20, 20, 90, 90, 90))
+    grid.spacegroup = gemmi.SpaceGroup('P 1')
+    r = random.Random(0)
+    for u in range(8):
+        for v in range(8):
+            for w in range(8):
+                grid.set_value(u, v, w, r.random())
+    ccp4 = gemmi.Ccp4Map()
+    ccp4.grid = grid
+    ccp4.update_ccp4_header(2, True)
+    ccp4.write_ccp4_map(templates['ccp4'])
+    sf = gemmi.transform_map_to_f_phi(grid, half_l=True)
+    mtz = gemmi.Mtz(with_base=True)
+    mtz.spacegroup = sf.spacegroup
+    mtz.set_cell_for_all(sf.unit_cell)
+    mtz.add_dataset('synthetic')
+    mtz.add_column('FWT', 'F')
+    mtz.add_column('PHWT', 'P')
+    mtz.set_data(sf.prepare_asu_data(dmin=5.0))
+    mtz.write_to_file(templates['mtz'])
+    return templates
+
+
+def dataset_files(dtag, events, version):
+    # file name in processed_datasets/<dtag> -> template
+    files = [
+        ('{0!s}-pandda-input.pdb'.format(dtag), 'pdb'),
+        ('{0!s}-pandda-input.mtz'.format(dtag), 'mtz'),
+        (os.path.join('ligand_files', 'LIG.pdb'), 'ligand_pdb'),
+        (os.path.join('ligand_files', 'LIG.cif'), 'ligand_cif')
+    ]
+    if version == 1:
+        files.append(('{0!s}-z_map.native.ccp4'.format(dtag), 'ccp4'))
+        files.append(('{0!s}-ground-state-average-map.native.ccp4'.format(dtag), 'ccp4'))
+        for event, bdc in events:
+            files.append(('{0!s}-event_{1!s}_1-BDC_{2!s}_map.native.ccp4'.format(dtag, event, bdc), 'ccp4'))
+    else:
+        files.append(('{0!s}-pandda-output.mtz'.format(dtag), 'mtz'))
+        for event, bdc in events:
+            files.append(('{0!s}-pandda-output-event-{1:03d}.mtz'.format(dtag, event), 'mtz'))
+    return files
+
+
+def make_pandda_dir(panddaDir, nEvents, eventsPerDataset, nSites, version, seed):
+    print('>>> creating PanDDA{0!s} directory with {1!s} events in {2!s}'.format(version, nEvents, panddaDir))
+    start = time.time()
+    r = random.Random(seed)
+    templateDir = tempfile.mkdtemp()
+    templates = make_templates(templateDir)
+    analyses = os.path.join(panddaDir, 'analyses')
+    processed_datasets = os.path.join(panddaDir, 'processed_datasets')
+    for d in (analyses, processed_datasets):
+        if not os.path.isdir(d):
+            os.makedirs(d)
+
+    rows = []
+    nDatasets = (nEvents + eventsPerDataset - 1) // eventsPerDataset
+    for n in range(nDatasets):
+        dtag = 'x{0:05d}'.format(n + 1)
+        events = []
+        for event in range(1, min(eventsPerDataset, nEvents - n * eventsPerDataset) + 1):
+            bdc = round(r.uniform(0.1, 0.9), 2)
+            events.append((event, bdc))
+            x, y, z = [round(r.uniform(0, 20), 3) for i in range(3)]
+            site = r.randint(1, nSites)
+            resolution = round(r.uniform(1.2, 2.8), 2)
+            r_work = round(r.uniform(0.15, 0.25), 4)
+            r_free = round(r_work + r.uniform(0.02, 0.06), 4)
+            z_peak = round(r.uniform(3, 12), 2)
+            z_mean = round(z_peak * r.uniform(0.3, 0.6), 2)
+            cluster_size = r.randint(5, 500)
+            if version == 1:
+                rows.append([dtag, event, site, bdc, z_peak, z_mean, cluster_size, x, y, z, x, y, z,
+                             resolution, 0.3, r_work, r_free])
+            else:
+                rows.append([dtag, event, site, bdc, cluster_size, x, y, z, z_peak, z_mean, resolution,
+                             r_work, r_free])
+        datasetDir = os.path.join(processed_datasets, dtag)
+        for d in (datasetDir, os.path.join(datasetDir, 'ligand_files'),
+                  os.path.join(datasetDir, 'modelled_structures')):
+            if not os.path.isdir(d):
+                os.mkdir(d)
+        for filename, template in dataset_files(dtag, events, version):
+            shutil.copyfile(templates[template], os.path.join(datasetDir, filename))
+
+    with open(os.path.join(analyses, 'pandda_analyse_events.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(pandda1_header if version == 1 else pandda2_header)
+        writer.writerows(rows)
+    with open(os.path.join(analyses, 'pandda_analyse_sites.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['site_idx', 'centroid'])
+        for site in range(1, nSites + 1):
+            writer.writerow([site, '(10.0, 10.0, 10.0)'])
+    shutil.rmtree(templateDir)
+    print('>>> created {0!s} datasets with {1!s} events in {2:.1f}s'.format(nDatasets, len(rows),
+                                                                           time.time() - start))
+    if gemmi is None:
+        print('WARNING: gemmi is not available; MTZ and CCP4 files are empty placeholders')
+
+
+def usage():
+    usage = (
+        '\n'
+        'make_pandda_dir.py creates a synthetic pandda directory for benchmarking\n'
+        '\n'
+        'usage:\n'
+        'python make_pandda_dir.py -o <pandda_dir> -e <number of events>\n'
+        'e.g.\n'
+        'python make_pandda_dir.py -o /tmp/pandda -e 1000\n'
+        '\n'
+        'additional command line options:\n'
+        '--version, -v 1|2\n'
+        '    creates the file layout of PanDDA1 (CCP4 maps) or PanDDA2 (MTZ files) (default: 1)\n'
+        '--datasetevents, -d N\n'
+        '    number of events per dataset (default: 3)\n'
+        '--sites, -s N\n'
+        '    number of sites (default: 10)\n'
+        '--seed N\n'
+        '    seed for the random event coordinates and statistics (default: 0)\n'
+    )
+    print(usage)
+
+
+def main(argv):
+    panddaDir = ''
+    nEvents = 100
+    eventsPerDataset = 3
+    nSites = 10
+    version = 1
+    seed = 0
+
+    try:
+        opts, args = getopt.getopt(argv, "o:e:v:d:s:h", ["output=", "events=", "version=", "datasetevents=",
+                                                        "sites=", "seed="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt in ("-o", "--output"):
+            panddaDir = os.path.abspath(arg)
+        elif opt in ("-e", "--events"):
+            nEvents = int(arg)
+        elif opt in ("-v", "--version"):
+            version = int(arg)
+        elif opt in ("-d", "--datasetevents"):
+            eventsPerDataset = int(arg)
+        elif opt in ("-s", "--sites"):
+            nSites = int(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+
+    if not panddaDir or version not in (1, 2) or nEvents < 1 or eventsPerDataset < 1 or nSites < 1:
+        usage()
+        sys.exit(2)
+    make_pandda_dir(panddaDir, nEvents, eventsPerDataset, nSites, version, seed)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
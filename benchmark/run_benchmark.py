@@ -0,0 +1,314 @@
+# Copyright (c) 2022, Tobias Krojer, MAX IV Laboratory
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import getopt
+import sys
+import os
+import json
+import shutil
+import tempfile
+import time
+import logging
+
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+benchmarkDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarkDir))
+sys.path.insert(0, os.path.join(os.path.dirname(benchmarkDir), 'archive'))
+
+import make_pandda_dir
+import inspect_pandda_analyse
+
+
+class syscall_counter(object):
+    # counts calls of the python functions that end up in file system system calls; read and write
+    # calls are taken from /proc/self/io where available (linux)
+    functions = [(os, 'stat'), (os, 'lstat'), (os, 'listdir'), (os, 'scandir'), (os, 'open'), (os, 'remove'),
+                 (os, 'rename'), (os, 'replace'), (os, 'fsync'), (os, 'mkdir'), (builtins, 'open')]
+
+    def __init__(self):
+        self.counts = {}
+        self.originals = []
+        for module, name in self.functions:
+            if hasattr(module, name):
+                self.originals.append((module, name, getattr(module, name)))
+
+    def wrap(self, name, function):
+        def counted(*args, **kwargs):
+            self.counts[name] = self.counts.get(name, 0) + 1
+            return function(*args, **kwargs)
+        return counted
+
+    def start(self):
+        self.counts = {}
+        self.io = self.read_proc_io()
+        for module, name, function in self.originals:
+            setattr(module, name, self.wrap(name, function))
+
+    def stop(self):
+        for module, name, function in self.originals:
+            setattr(module, name, function)
+        io = self.read_proc_io()
+        for key in ('syscr', 'syscw'):
+            if key in io and key in self.io:
+                self.counts[key] = io[key] - self.io[key]
+        return self.counts
+
+    def read_proc_io(self):
+        io = {}
+        if os.path.isfile('/proc/self/io'):
+            with open('/proc/self/io') as f:
+                for line in f:
+                    key, value = line.split(':')
+                    io[key] = int(value)
+        return io
+
+
+def peak_rss():
+    # kilobytes on linux, bytes on macOS
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(results, stage, calls, function, *args):
+    # runs function and records wall time, system calls and peak memory of the python heap
+    counter = syscall_counter()
+    if tracemalloc:
+        tracemalloc.start()
+    counter.start()
+    start = time.time()
+    try:
+        value = function(*args)
+    finally:
+        seconds = time.time() - start
+        counts = counter.stop()
+        peak = None
+        if tracemalloc:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    results.append({
+        'stage': stage,
+        'calls': calls,
+        'seconds': seconds,
+        'seconds_per_call': seconds / calls if calls else None,
+        'syscalls': counts,
+        'peak_python_memory': peak,
+        'peak_rss': peak_rss()
+    })
+    return value
+
+
+def quiet_logger():
+    logger = logging.getLogger('inspect_benchmark')
+    logger.propagate = False
+    logger.setLevel(logging.ERROR)
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler(sys.stderr))
+    return logger
+
+
+def update_params_of_rows(session, rows):
+    for row in rows:
+        session.index = row
+        session.update_params()
+
+
+def navigate(session, nEvents):
+    session.select('show all events')
+    for n in range(nEvents):
+        session.change_event(1)
+
+
+def convert_maps(panddaDir, jobs):
+    try:
+        import convert_event_map_to_mtz
+    except ImportError as e:
+        print('WARNING: skipping map conversion: {0!s}'.format(e))
+        return
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        convert_event_map_to_mtz.convert_event_maps_to_mtz(panddaDir, '', '', None, True, False, False, False,
+                                                           jobs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def run_benchmark(panddaDir, nNavigate, jobs, prefetch, convert):
+    logger = quiet_logger()
+    results = []
+
+    session = inspect_pandda_analyse.inspect_session(inspect_pandda_analyse.stub_coot(), logger, None)
+    session.prefetch_depth = prefetch
+    # creates pandda_inspect_events.csv the first time
+    if not session.open_pandda_folder(panddaDir):
+        print('ERROR: {0!s} is not a pandda directory'.format(panddaDir))
+        return results
+
+    # without and with the session snapshot that is saved when the folder is opened
+    os.remove(session.session_snapshot())
+    session = inspect_pandda_analyse.inspect_session(inspect_pandda_analyse.stub_coot(), logger, None)
+    session.prefetch_depth = prefetch
+    measure(results, 'parsepanddaDir', 1, session.open_pandda_folder, panddaDir)
+    session = inspect_pandda_analyse.inspect_session(inspect_pandda_analyse.stub_coot(), logger, None)
+    session.prefetch_depth = prefetch
+    measure(results, 'load_session_snapshot', 1, session.open_pandda_folder, panddaDir)
+    nNavigate = min(nNavigate, len(session.events))
+    measure(results, 'update_params', nNavigate, update_params_of_rows, session, range(nNavigate))
+    measure(results, 'RefreshData', nNavigate, navigate, session, nNavigate)
+    measure(results, 'save_pandda_inspect_events_csv_file', 1, session.save_pandda_inspect_events_csv_file)
+    if convert:
+        measure(results, 'convert_event_maps_to_mtz', 1, convert_maps, panddaDir, jobs)
+    return results
+
+
+def print_results(results):
+    print('\n{0:<38s} {1:>7s} {2:>10s} {3:>10s} {4:>8s} {5:>8s} {6:>8s} {7:>8s} {8:>12s}'.format(
+        'stage', 'calls', 'total (s)', 'per call', 'stat', 'listdir', 'open', 'read', 'peak mem'))
+    for r in results:
+        s = r['syscalls']
+        peak = r['peak_python_memory']
+        print('{0:<38s} {1:>7d} {2:>10.3f} {3:>10.5f} {4:>8d} {5:>8d} {6:>8d} {7:>8s} {8:>12s}'.format(
+            r['stage'], r['calls'], r['seconds'], r['seconds_per_call'],
+            s.get('stat', 0) + s.get('lstat', 0),
+            s.get('listdir', 0) + s.get('scandir', 0),
+            s.get('open', 0),
+            str(s.get('syscr', '-')),
+            '{0:.1f} MB'.format(peak / 1048576.0) if peak is not None else '-'))
+
+
+def usage():
+    usage = (
+        '\n'
+        'run_benchmark.py measures how the inspect plugin and the map conversion scale with the size of a\n'
+        'pandda directory; COOT is replaced by a stub that only reads the files\n'
+        '\n'
+        'usage:\n'
+        'python run_benchmark.py -e <number of events>\n'
+        'python run_benchmark.py -p <pandda_dir>\n'
+        'e.g.\n'
+        'python run_benchmark.py -e 100,1000,10000 -v 2\n'
+        '\n'
+        'additional command line options:\n'
+        '--events, -e N[,N...]\n'
+        '    creates synthetic pandda directories of the given sizes in a temporary folder (default: 100)\n'
+        '--version, -v 1|2\n'
+        '    file layout of the synthetic pandda directories (default: 1)\n'
+        '--panddadir, -p DIRECTORY\n'
+        '    benchmarks an existing pandda directory instead; the directory is copied to a temporary\n'
+        '    folder first and is not changed\n'
+        '--navigate, -n N\n'
+        '    number of events that are loaded (default: 100)\n'
+        '--prefetch N\n'
+        '    number of events prefetched in the background while navigating (default: 0)\n'
+        '--convert, -c\n'
+        '    also converts all CCP4 maps to MTZ format (needs gemmi)\n'
+        '--jobs, -j N\n'
+        '    number of parallel map conversions; system calls of the workers are not counted (default: 1)\n'
+        '--json FILE\n'
+        '    writes the results to FILE, e.g. to compare them between versions\n'
+    )
+    print(usage)
+
+
+def main(argv):
+    sizes = [100]
+    version = 1
+    panddaDir = ''
+    nNavigate = 100
+    prefetch = 0
+    convert = False
+    jobs = 1
+    jsonFile = ''
+
+    try:
+        opts, args = getopt.getopt(argv, "e:v:p:n:j:ch", ["events=", "version=", "panddadir=", "navigate=",
+                                                         "prefetch=", "convert", "jobs=", "json="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt in ("-e", "--events"):
+            sizes = [int(n) for n in arg.split(',')]
+        elif opt in ("-v", "--version"):
+            version = int(arg)
+        elif opt in ("-p", "--panddadir"):
+            panddaDir = os.path.abspath(arg)
+        elif opt in ("-n", "--navigate"):
+            nNavigate = int(arg)
+        elif opt == "--prefetch":
+            prefetch = int(arg)
+        elif opt in ("-c", "--convert"):
+            convert = True
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
+        elif opt == "--json":
+            jsonFile = os.path.abspath(arg)
+
+    report = []
+    if panddaDir:
+        # the benchmark saves the event table, deletes the session snapshot and converts maps, so it
+        # runs on a copy of the directory
+        tmpDir = tempfile.mkdtemp()
+        try:
+            copyDir = os.path.join(tmpDir, os.path.basename(panddaDir))
+            print('>>> copying {0!s} to {1!s}'.format(panddaDir, copyDir))
+            shutil.copytree(panddaDir, copyDir, symlinks=True)
+            results = run_benchmark(copyDir, nNavigate, jobs, prefetch, convert)
+            print_results(results)
+            report.append({'panddadir': panddaDir, 'results': results})
+        finally:
+            shutil.rmtree(tmpDir)
+    else:
+        for size in sizes:
+            tmpDir = tempfile.mkdtemp()
+            try:
+                make_pandda_dir.make_pandda_dir(tmpDir, size, 3, 10, version, 0)
+                results = run_benchmark(tmpDir, nNavigate, jobs, prefetch, convert)
+                print_results(results)
+                report.append({'events': size, 'version': version, 'results': results})
+            finally:
+                shutil.rmtree(tmpDir)
+
+    if jsonFile:
+        with open(jsonFile, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('\n>>> wrote results to {0!s}'.format(jsonFile))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -22,54 +22,1934 @@
 
 import os
 import glob
+import bisect
 import sys
 import shutil
+import atexit
+import time
+import math
+import hashlib
+import tempfile
+import threading
+import subprocess
+import itertools
+import functools
+import numbers
+from array import array
+from collections import OrderedDict
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+try:
+    import gtk
+    import coot
+except ImportError:
+    # inspect_session can be used without COOT, e.g. with stub_coot
+    gtk = None
+    coot = None
+import __main__
+
+import csv
+import json
+import logging
+import logging.handlers
+
+
+class async_log_handler(logging.Handler):
+    # passes records to a background thread that writes them to the terminal and the log file, so that
+    # logging does not hold up COOT; logging.handlers.QueueHandler is not available in python 2
+    def __init__(self, targets):
+        logging.Handler.__init__(self)
+        self.targets = targets
+        self.records = queue.Queue()
+        self.thread = threading.Thread(target=self.process)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def emit(self, record):
+        try:
+            # the message is formatted right away, in case the arguments change before the record is written
+            self.format(record)
+            record.msg = record.message
+            record.args = None
+            record.exc_info = None
+            self.records.put(record)
+        except Exception:
+            self.handleError(record)
+
+    def process(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+            for target in self.targets:
+                if record.levelno >= target.level:
+                    target.handle(record)
+
+    def close(self):
+        # writes all remaining records
+        if self.thread.is_alive():
+            self.records.put(None)
+            self.thread.join()
+        for target in self.targets:
+            target.close()
+        logging.Handler.close(self)
+
+
+def init_logger(logfile, max_bytes=10 * 1024 ** 2, backup_count=3):
+    # handlers are only added once per logfile, e.g. when the plugin is started again in the same COOT session;
+    # inspect.log is renamed to inspect.log.1 when it reaches max_bytes and at most backup_count old files are kept
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logfile = os.path.abspath(logfile)
+    for handler in list(logger.handlers):
+        if handler.get_name() == 'inspect':
+            if getattr(handler, 'logfile', None) == logfile:
+                return logger
+            logger.removeHandler(handler)
+            handler.close()
+
+    formatter = logging.Formatter('%(asctime)s | %(levelname)s - INSPECT | %(message)s', '%m-%d-%Y %H:%M:%S')
+
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setLevel(logging.DEBUG)
+    stdout_handler.setFormatter(formatter)
+
+    file_handler = logging.handlers.RotatingFileHandler(logfile, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(formatter)
+
+    handler = async_log_handler([stdout_handler, file_handler])
+    handler.set_name('inspect')
+    handler.logfile = logfile
+    logger.addHandler(handler)
+
+    return logger
+
+
+def find_executable(name):
+    try:
+        return shutil.which(name)
+    except AttributeError:
+        # python 2
+        from distutils.spawn import find_executable as which
+        return which(name)
+
+
+def find_converter_script():
+    # convert_event_map_to_mtz.py is either next to this plugin, in the archive folder of the
+    # repository or somewhere in PATH
+    try:
+        plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        plugin_dir = os.getcwd()
+    for script in [os.path.join(plugin_dir, 'convert_event_map_to_mtz.py'),
+                   os.path.join(plugin_dir, 'archive', 'convert_event_map_to_mtz.py')]:
+        if os.path.isfile(script):
+            return script
+    return find_executable('convert_event_map_to_mtz.py')
+
+
+def write_csv_file(filename, rows):
+    # write into a temporary file in the same folder and rename it, so that a crash cannot leave a
+    # truncated file behind
+    fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(filename), dir=os.path.dirname(filename))
+    with os.fdopen(fd, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    move_into_place(tmp, filename)
+
+
+def move_into_place(tmp, filename):
+    # mkstemp creates files that are only readable by the owner
+    if os.path.isfile(filename):
+        shutil.copymode(filename, tmp)
+    else:
+        os.chmod(tmp, 0o644)
+    if hasattr(os, 'replace'):
+        os.replace(tmp, filename)
+    else:
+        if os.name == 'nt' and os.path.isfile(filename):
+            os.remove(filename)
+        os.rename(tmp, filename)
+
+
+def convert_analyse_csv(analyse_csv, inspect_csv, labels, values, table=None):
+    # copies the CSV file of pandda.analyse row by row and adds the columns with the annotations; the rows
+    # are also added to table, so that the new file does not need to be read again
+    fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(inspect_csv), dir=os.path.dirname(inspect_csv))
+    try:
+        with open(analyse_csv) as r:
+            with os.fdopen(fd, 'w') as f:
+                reader = csv.reader(r)
+                writer = csv.writer(f)
+                header = next(reader, [])
+                n = len(header)
+                header = header + labels
+                writer.writerow(header)
+                if table is not None:
+                    table.start(header)
+                for row in reader:
+                    if len(row) < n:
+                        row = row + [''] * (n - len(row))
+                    row = row + values
+                    writer.writerow(row)
+                    if table is not None:
+                        table.append(row)
+                f.flush()
+                os.fsync(f.fileno())
+    except Exception:
+        os.remove(tmp)
+        raise
+    move_into_place(tmp, inspect_csv)
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return float('nan')
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return -1
+
+
+class event_table(object):
+    # columnar copy of pandda_inspect_events.csv; all columns are kept as strings so that the file
+    # can be written back unchanged, and the columns used for navigation and selection are also
+    # kept as typed arrays
+
+    # column name -> (CSV header(s) of PanDDA1/ PanDDA2, type, required)
+    columns = OrderedDict([
+        ('dtag', (['dtag'], 'str', True)),
+        ('event', (['event_num', 'event_idx'], 'int', True)),
+        ('site', (['site_num', 'site_idx'], 'int', True)),
+        ('bdc', (['bdc', '1-BDC'], 'float', True)),
+        ('x', (['x'], 'float', True)),
+        ('y', (['y'], 'float', True)),
+        ('z', (['z'], 'float', True)),
+        ('resolution', (['analysed_resolution', 'high_resolution'], 'float', True)),
+        ('r_work', (['r_work'], 'float', True)),
+        ('r_free', (['r_free'], 'float', True)),
+        ('cluster_size', (['cluster_size'], 'int', False)),
+        ('z_peak', (['z_peak'], 'float', False)),
+        ('z_mean', (['z_mean'], 'float', False)),
+        ('viewed', (['Viewed'], 'bool', True)),
+        ('ligand_placed', (['Ligand Placed'], 'bool', True)),
+        ('ligand_confidence', (['Ligand Confidence'], 'category', True))
+    ])
+
+    def __init__(self):
+        self.header = []
+        self.data = []          # one list of strings per CSV column
+        self.position = {}      # column name -> position in CSV file
+        self.typed = {}         # column name -> array or list with typed values
+        self.categories = {}    # column name -> list of categories
+        self.row_of_event = {}  # (dtag, event) -> row
+        self.rows_of_site = {}  # site -> rows in current order
+
+    # everything that is needed to use the table without reading and converting the CSV file again
+    state_attributes = ['header', 'data', 'position', 'typed', 'categories', 'row_of_event', 'rows_of_site']
+
+    def __len__(self):
+        if not self.data:
+            return 0
+        return len(self.data[0])
+
+    def state(self):
+        return dict((name, getattr(self, name)) for name in self.state_attributes)
+
+    def restore(self, state):
+        for name in self.state_attributes:
+            setattr(self, name, state[name])
+
+    def read(self, filename):
+        with open(filename) as f:
+            reader = csv.reader(f)
+            self.start(next(reader))
+            for row in reader:
+                self.append(row)
+        self.resolve_header()
+
+    def start(self, header):
+        self.header = header
+        self.data = [[] for item in self.header]
+
+    def append(self, row):
+        # rows need to be added before resolve_header is called
+        if len(row) < len(self.header):
+            row = row + [''] * (len(self.header) - len(row))
+        for n, column in enumerate(self.data):
+            column.append(row[n])
+
+    def resolve_header(self):
+        self.position = {}
+        missing = []
+        for name, (labels, kind, required) in self.columns.items():
+            for label in labels:
+                if label in self.header:
+                    self.position[name] = self.header.index(label)
+                    break
+            if name not in self.position and required:
+                missing.append(' or '.join(labels))
+        if missing:
+            raise ValueError('missing column(s) in CSV file: {0!s}'.format(', '.join(missing)))
+        self.typed = {}
+        for name in self.position:
+            self.typed[name] = self.convert(name, self.data[self.position[name]])
+        self.build_index()
+
+    def build_index(self):
+        # hash indexes used for navigation; only need rebuilding when the row order changes
+        self.row_of_event = {}
+        self.rows_of_site = {}
+        for n, (dtag, event, site) in enumerate(zip(self.data[self.position['dtag']],
+                                                    self.data[self.position['event']],
+                                                    self.typed['site'])):
+            self.row_of_event[(dtag, event)] = n
+            self.rows_of_site.setdefault(site, []).append(n)
+
+    def convert(self, name, values):
+        kind = self.columns[name][1]
+        if kind == 'float':
+            return array('d', [to_float(v) for v in values])
+        elif kind == 'int':
+            return array('l', [to_int(v) for v in values])
+        elif kind == 'bool':
+            return array('b', [v == 'True' for v in values])
+        elif kind == 'category':
+            self.categories[name] = sorted(set(values))
+            code = dict((c, n) for n, c in enumerate(self.categories[name]))
+            return array('l', [code[v] for v in values])
+        return list(values)
+
+    def position_of(self, name):
+        # accepts column names and CSV header labels
+        if name in self.position:
+            return self.position[name]
+        return self.header.index(name)
+
+    def label(self, name):
+        return self.header[self.position_of(name)]
+
+    def get(self, row, name):
+        return self.data[self.position_of(name)][row]
+
+    def value(self, row, name):
+        if self.columns[name][1] == 'category':
+            return self.categories[name][self.typed[name][row]]
+        return self.typed[name][row]
+
+    def column(self, name):
+        return self.typed[name]
+
+    def set(self, row, name, value):
+        position = self.position_of(name)
+        self.data[position][row] = value
+        for column, p in self.position.items():
+            if p == position:
+                if self.columns[column][1] == 'category':
+                    if value not in self.categories[column]:
+                        self.categories[column].append(value)
+                    self.typed[column][row] = self.categories[column].index(value)
+                else:
+                    self.typed[column][row] = self.convert(column, [value])[0]
+
+    def where(self, name, test):
+        # row numbers of all rows where test(value) is true; categorical columns are tested once per
+        # category rather than once per row
+        if self.columns[name][1] == 'category':
+            codes = set(n for n, c in enumerate(self.categories[name]) if test(c))
+            return [n for n, code in enumerate(self.typed[name]) if code in codes]
+        return [n for n, v in enumerate(self.typed[name]) if test(v)]
+
+    def sort(self, *names):
+        # sorts all columns by the typed values of the given columns; a leading '-' sorts a column in
+        # descending order
+        order = list(range(len(self)))
+        for name in reversed(names):
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if self.columns[name][1] == 'category':
+                key = [self.categories[name][c] for c in self.typed[name]]
+            else:
+                key = self.typed[name]
+            # python's sort is stable, so sorting by the least significant column first gives a
+            # multi-key sort
+            order.sort(key=lambda n: key[n], reverse=descending)
+        self.data = [[column[n] for n in order] for column in self.data]
+        for name in self.typed:
+            if isinstance(self.typed[name], list):
+                self.typed[name] = [self.typed[name][n] for n in order]
+            else:
+                self.typed[name] = array(self.typed[name].typecode, [self.typed[name][n] for n in order])
+        self.build_index()
+
+    def rows(self):
+        # header and rows as written to pandda_inspect_events.csv
+        return [self.header] + [list(row) for row in zip(*self.data)]
+
+
+class event_query(object):
+    # named selection of events: all conditions need to be true for an event to be selected, and the
+    # table is sorted by the sort columns first (a leading '-' sorts in descending order)
+    #
+    # conditions are [column, operator, value] with the following operators
+    #   ==, !=, <, <=, >, >=    comparison with the typed value of the column
+    #   between                 value is [low, high], both inclusive
+    #   in                      value is a list of allowed values
+    #   contains                value is a substring of the column value
+
+    operators = {
+        '==': lambda v, x: v == x,
+        '!=': lambda v, x: v != x,
+        '<': lambda v, x: v < x,
+        '<=': lambda v, x: v <= x,
+        '>': lambda v, x: v > x,
+        '>=': lambda v, x: v >= x,
+        'between': lambda v, x: x[0] <= v <= x[1],
+        'in': lambda v, x: v in x,
+        'contains': lambda v, x: x in str(v)
+    }
+
+    def __init__(self, name, conditions=None, sort=None):
+        self.name = name
+        self.conditions = conditions or []
+        self.sort = sort or []
+        for column, operator, value in self.conditions:
+            if column not in event_table.columns:
+                raise ValueError('unknown column in query {0!s}: {1!s}'.format(name, column))
+            if operator not in self.operators:
+                raise ValueError('unknown operator in query {0!s}: {1!s}'.format(name, operator))
+            self.check_value(column, operator, value)
+        for column in self.sort:
+            if column.lstrip('-') not in event_table.columns:
+                raise ValueError('unknown sort column in query {0!s}: {1!s}'.format(name, column))
+
+    def check_value(self, column, operator, value):
+        # values that cannot be compared with the values of the column would only fail when the query is used
+        if event_table.columns[column][1] in ('float', 'int', 'bool'):
+            kind, expected = numbers.Real, 'a number'
+        else:
+            kind, expected = string_types, 'a string'
+        if operator == 'between':
+            if not isinstance(value, (list, tuple)) or len(value) != 2 or \
+                    not all(isinstance(x, kind) for x in value):
+                raise ValueError('{0!s} between needs [low, high] in query {1!s}'.format(column, self.name))
+        elif operator == 'in':
+            if not isinstance(value, (list, tuple)) or not all(isinstance(x, kind) for x in value):
+                raise ValueError('{0!s} in needs a list of values in query {1!s}'.format(column, self.name))
+        elif operator == 'contains':
+            if not isinstance(value, string_types):
+                raise ValueError('{0!s} contains needs a string in query {1!s}'.format(column, self.name))
+        elif not isinstance(value, kind):
+            raise ValueError('{0!s} {1!s} needs {2!s} in query {3!s}'.format(column, operator, expected, self.name))
+
+    def missing_columns(self, table):
+        # optional columns used by the query that are not in this CSV file
+        columns = [c[0] for c in self.conditions] + [c.lstrip('-') for c in self.sort]
+        return sorted(set(c for c in columns if c not in table.typed))
+
+    def select(self, table):
+        # sorts the table if required and returns the selected rows in table order
+        missing = self.missing_columns(table)
+        if missing:
+            raise ValueError('column(s) not available in CSV file: {0!s}'.format(', '.join(missing)))
+        if self.sort:
+            table.sort(*self.sort)
+        rows = None
+        for column, operator, value in self.conditions:
+            test = self.operators[operator]
+            selected = set(table.where(column, lambda v: test(v, value)))
+            rows = selected if rows is None else rows & selected
+        if rows is None:
+            return list(range(len(table)))
+        return sorted(rows)
+
+
+def list_folder(folder):
+    # returns names of files and of subfolders; os.scandir (python 3) avoids one stat call per entry
+    files = set()
+    folders = set()
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(folder):
+            if entry.is_dir():
+                folders.add(entry.name)
+            elif entry.is_file():
+                files.add(entry.name)
+    else:
+        for name in os.listdir(folder):
+            if os.path.isdir(os.path.join(folder, name)):
+                folders.add(name)
+            else:
+                files.add(name)
+    return files, folders
+
+
+class directory_index(object):
+    # in-memory listing of processed_datasets/<dtag>/ and its modelled_structures and ligand_files
+    # subfolders; a folder is listed again as soon as its mtime changes
+    def __init__(self, logger):
+        self.logger = logger
+        self.processed_datasets = None
+        self.folders = {}   # folder -> [mtime, set of file names]
+        self.lock = threading.Lock()
+
+    def build(self, processed_datasets):
+        self.logger.info('indexing files in {0!s}'.format(processed_datasets))
+        with self.lock:
+            self.processed_datasets = processed_datasets
+            self.folders = {}
+        if not os.path.isdir(processed_datasets):
+            self.logger.error('cannot find {0!s}'.format(processed_datasets))
+            return
+        files, folders = list_folder(processed_datasets)
+        for dtag in sorted(folders):
+            self.refresh(dtag)
+        self.logger.info('indexed {0!s} datasets'.format(len(folders)))
+
+    def state(self):
+        with self.lock:
+            return dict(self.folders)
+
+    def restore(self, processed_datasets, folders):
+        # folders are listed again when they are used and their mtime changed in the meantime
+        with self.lock:
+            self.processed_datasets = processed_datasets
+            self.folders = folders
+
+    def dataset_folders(self, dtag):
+        dataset = os.path.join(self.processed_datasets, dtag)
+        return [dataset,
+                os.path.join(dataset, 'modelled_structures'),
+                os.path.join(dataset, 'ligand_files')]
+
+    def refresh(self, dtag):
+        if self.processed_datasets is None:
+            return
+        for folder in self.dataset_folders(dtag):
+            try:
+                mtime = os.stat(folder).st_mtime
+            except OSError:
+                mtime = None
+            with self.lock:
+                entry = self.folders.get(folder)
+            if entry is not None and entry[0] == mtime:
+                continue
+            files = set()
+            if mtime is not None:
+                files, folders = list_folder(folder)
+            with self.lock:
+                self.folders[folder] = [mtime, files]
+
+    def isfile(self, path):
+        with self.lock:
+            entry = self.folders.get(os.path.dirname(path))
+        if entry is None:
+            # not part of the index, e.g. <dtag>/<event>/rhofit
+            return os.path.isfile(path)
+        return os.path.basename(path) in entry[1]
+
+    def files(self, folder, suffix=''):
+        with self.lock:
+            entry = self.folders.get(folder)
+        if entry is None:
+            return sorted(glob.glob(os.path.join(folder, '*' + suffix)))
+        return sorted(os.path.join(folder, f) for f in entry[1] if f.endswith(suffix))
+
+
+class file_cache(object):
+    # local copies of files on (slow) network mounts; entries are only served as long as
+    # size and mtime of the original file did not change
+    def __init__(self, logger, max_bytes=1024 ** 3):
+        self.logger = logger
+        self.max_bytes = max_bytes
+        self.cache_dir = None
+        self.entries = OrderedDict()    # original path -> [local path, size, mtime]
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def local_path(self, path):
+        if self.cache_dir is None:
+            self.cache_dir = tempfile.mkdtemp(prefix='pandda_inspect_')
+            atexit.register(self.cleanup)
+        folder = os.path.dirname(path)
+        if not isinstance(folder, bytes):
+            # only unicode paths are encoded; byte string paths in python 2 can contain any characters
+            folder = folder.encode('utf-8', 'surrogateescape' if sys.version_info[0] >= 3 else 'strict')
+        subdir = hashlib.md5(folder).hexdigest()[:12]
+        return os.path.join(self.cache_dir, subdir, os.path.basename(path))
+
+    def store(self, path):
+        with self.lock:
+            if path in self.entries:
+                return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        local = self.local_path(path)
+        if not os.path.isdir(os.path.dirname(local)):
+            os.makedirs(os.path.dirname(local))
+        with open(path, 'rb') as src:
+            with open(local, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        with self.lock:
+            self.entries[path] = [local, st.st_size, st.st_mtime]
+            self.size += st.st_size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, path):
+        # needs to be called while holding self.lock
+        local, size, mtime = self.entries.pop(path)
+        self.size -= size
+        if os.path.isfile(local):
+            os.remove(local)
+
+    def get(self, path):
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is None:
+            return path
+        try:
+            st = os.stat(path)
+        except OSError:
+            return path
+        with self.lock:
+            if path not in self.entries:
+                return path
+            if [st.st_size, st.st_mtime] != self.entries[path][1:]:
+                self.logger.info('{0!s} changed since it was prefetched; reading original file'.format(path))
+                self.remove(path)
+                return path
+            self.entries[path] = self.entries.pop(path)     # most recently used entries go to the end
+        self.logger.info('reading prefetched copy of {0!s}'.format(path))
+        return entry[0]
+
+    def cleanup(self):
+        if self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class map_converter(object):
+    # converts CCP4 maps into MTZ files with convert_event_map_to_mtz.py on a worker thread; maps of
+    # the current event (priority 0) are converted before maps of upcoming events (priority 1)
+    def __init__(self, logger, cache):
+        self.logger = logger
+        self.cache = cache
+        self.script = find_converter_script()
+        self.python = find_executable('ccp4-python')
+        self.jobs = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.scheduled = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        if self.script is None or self.python is None:
+            self.logger.warning('cannot find ccp4-python or convert_event_map_to_mtz.py; '
+                                'CCP4 maps will not be converted to MTZ format')
+
+    def available(self):
+        return self.script is not None and self.python is not None
+
+    def schedule(self, ccp4, priority):
+        if not self.available():
+            return
+        with self.lock:
+            if ccp4 in self.scheduled:
+                return
+            self.scheduled.add(ccp4)
+        self.jobs.put((priority, next(self.counter), ccp4))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            priority, n, ccp4 = self.jobs.get()
+            try:
+                self.convert(ccp4)
+            finally:
+                # a map whose conversion failed is tried again the next time it is scheduled
+                with self.lock:
+                    self.scheduled.discard(ccp4)
+
+    def convert(self, ccp4):
+        mtz = ccp4.replace('.ccp4', '.mtz')
+        if os.path.isfile(mtz):
+            return
+        self.logger.info('converting {0!s} to MTZ format'.format(ccp4))
+        try:
+            p = subprocess.Popen([self.python, self.script, '-f', ccp4],
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            out = p.communicate()[0]
+        except OSError as e:
+            self.logger.error('cannot run {0!s}: {1!s}'.format(self.script, e))
+            return
+        if p.returncode != 0 or not os.path.isfile(mtz):
+            self.logger.error('conversion of {0!s} failed:\n{1!s}'.format(ccp4, out))
+            return
+        self.logger.info('created {0!s}'.format(mtz))
+        try:
+            self.cache.store(mtz)
+        except (IOError, OSError) as e:
+            # the map is read from its original location instead
+            self.logger.error('cannot copy {0!s} to local cache: {1!s}'.format(mtz, e))
+
+
+class event_prefetcher(object):
+    # copies the files of the next events into a file_cache on a worker thread; CCP4 maps are handed
+    # over to the map_converter instead
+    def __init__(self, logger, find_event_files, cache, converter):
+        self.logger = logger
+        self.find_event_files = find_event_files
+        self.cache = cache
+        self.converter = converter
+        self.jobs = queue.Queue()
+        self.thread = None
+
+    def schedule(self, events):
+        # pending jobs are outdated as soon as the user moved on to another event
+        while True:
+            try:
+                self.jobs.get_nowait()
+            except queue.Empty:
+                break
+        for event in events:
+            self.jobs.put(event)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            xtal, event, bdc = self.jobs.get()
+            try:
+                for f in self.find_event_files(xtal, event, bdc):
+                    if f.endswith('.ccp4') and self.converter.available():
+                        self.converter.schedule(f, 1)
+                    elif f:
+                        self.cache.store(f)
+            except (IOError, OSError) as e:
+                self.logger.warning('prefetching files for {0!s}, event: {1!s} failed: {2!s}'.format(xtal, event, e))
+            except Exception as e:
+                # e.g. an unexpected value in the event table; the thread keeps prefetching the next events
+                self.logger.error('prefetching files for {0!s}, event: {1!s} failed: {2!s}: {3!s}'.format(
+                    xtal, event, type(e).__name__, e))
+
+
+class molecule_cache(object):
+    # COOT molecules that can be reused for other events of the same dataset; entries are keyed by
+    # (dtag, kind, file name, mtime) and the least recently used maps of other datasets are closed
+    # as soon as more than max_maps maps are loaded
+    def __init__(self, logger, backend, max_maps=12):
+        self.logger = logger
+        self.backend = backend
+        self.max_maps = max_maps
+        self.entries = OrderedDict()    # key -> list of imols
+
+    def key(self, dtag, kind, filename):
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            mtime = None
+        return dtag, kind, filename, mtime
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        imols = self.entries.pop(key)
+        self.entries[key] = imols
+        return imols
+
+    def add(self, key, imols):
+        # an older version of the same file is not needed anymore
+        for k in list(self.entries):
+            if k[:2] == key[:2]:
+                self.close(k)
+        self.entries[key] = imols
+
+    def close(self, key):
+        imols = self.entries.pop(key)
+        if not isinstance(imols, list):
+            imols = [imols]
+        for imol in imols:
+            self.backend.close_molecule(imol)
+
+    def contains(self, imol):
+        for imols in self.entries.values():
+            if imol == imols or isinstance(imols, list) and imol in imols:
+                return True
+        return False
+
+    def discard(self, imol):
+        for k in list(self.entries):
+            if self.entries[k] == imol or isinstance(self.entries[k], list) and imol in self.entries[k]:
+                del self.entries[k]
+
+    def number_of_maps(self):
+        n = 0
+        for k in self.entries:
+            if k[1] != 'protein':
+                n += len(self.entries[k]) if isinstance(self.entries[k], list) else 1
+        return n
+
+    def evict(self, dtag):
+        for k in list(self.entries):
+            if self.number_of_maps() <= self.max_maps:
+                break
+            if k[0] != dtag:
+                self.logger.info('closing {0!s} of {1!s}'.format(k[1], k[0]))
+                self.close(k)
+
+
+class timing_log(object):
+    # durations of the stages of loading and saving events as JSON lines, e.g.
+    # {"session": "1697616000-4242", "stage": "load_emap", "start": 1697616042.513, "seconds": 0.52,
+    #  "dtag": "x0001", "event": "1"}
+    # like inspect.log, the file is renamed to <filename>.1 when it reaches max_bytes and at most
+    # backup_count old files are kept
+    def __init__(self, filename, max_bytes=10 * 1024 ** 2, backup_count=3):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.session = '{0:d}-{1:d}'.format(int(time.time()), os.getpid())
+        self.lock = threading.Lock()
+        self.f = None
+
+    def write(self, stage, start, seconds, **context):
+        if self.filename is None:
+            return
+        record = OrderedDict([('session', self.session), ('stage', stage), ('start', round(start, 3)),
+                              ('seconds', round(seconds, 6))])
+        for key in sorted(context):
+            record[key] = context[key]
+        with self.lock:
+            if self.f is None:
+                self.f = open(self.filename, 'a')
+            self.f.write(json.dumps(record) + '\n')
+            self.f.flush()
+            if self.f.tell() >= self.max_bytes:
+                self.rollover()
+
+    def rollover(self):
+        self.f.close()
+        self.f = None
+        for n in range(self.backup_count - 1, 0, -1):
+            old = '{0!s}.{1:d}'.format(self.filename, n)
+            if os.path.isfile(old):
+                move_into_place(old, '{0!s}.{1:d}'.format(self.filename, n + 1))
+        if self.backup_count > 0:
+            move_into_place(self.filename, self.filename + '.1')
+        else:
+            os.remove(self.filename)
+
+
+def timed(method):
+    # records how long a method of inspect_session takes in its timing log
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.timings.write(method.__name__, start, time.time() - start, dtag=self.xtal, event=self.event)
+    return wrapper
+
+
+def percentile(values, p):
+    # nearest-rank percentile of sorted values
+    n = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(0, min(n, len(values) - 1))]
+
+
+def summarize_timings(filename, all_sessions=False):
+    # p50/ p95 per stage of the last session in the timing log, or of all sessions
+    records = []
+    with open(filename) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # e.g. last line of a session that crashed while writing
+                continue
+    if not records:
+        print('no timings in {0!s}'.format(filename))
+        return
+    if not all_sessions:
+        last = records[-1]['session']
+        records = [r for r in records if r['session'] == last]
+    stages = {}
+    for r in records:
+        stages.setdefault(r['stage'], []).append(r['seconds'])
+    sessions = sorted(set(r['session'] for r in records))
+    print('{0!s} session(s): {1!s}'.format(len(sessions), ', '.join(sessions)))
+    print('{0:<42s} {1:>7s} {2:>9s} {3:>9s} {4:>9s} {5:>10s}'.format('stage', 'n', 'p50 (s)', 'p95 (s)',
+                                                                     'max (s)', 'total (s)'))
+    for stage in sorted(stages, key=lambda k: -sum(stages[k])):
+        values = sorted(stages[stage])
+        print('{0:<42s} {1:>7d} {2:>9.4f} {3:>9.4f} {4:>9.4f} {5:>10.3f}'.format(
+            stage, len(values), percentile(values, 50), percentile(values, 95), values[-1], sum(values)))
+
+
+class timed_backend(object):
+    # COOT functions that read or write files are recorded in the timing log
+    timed_functions = ['handle_read_draw_molecule_with_recentre', 'make_and_draw_map', 'read_ccp4_map',
+                       'auto_read_make_and_draw_maps', 'read_cif_dictionary', 'write_pdb_file', 'close_molecule']
+
+    def __init__(self, backend, timings):
+        self.backend = backend
+        self.timings = timings
+
+    def __getattr__(self, name):
+        function = getattr(self.backend, name)
+        if name not in self.timed_functions:
+            return function
+
+        def call(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                filename = args[0] if args and not isinstance(args[0], int) else None
+                self.timings.write(name, start, time.time() - start, file=filename)
+        return call
+
+
+class coot_backend(object):
+    # COOT functions are either in the coot module or in the python scripts that COOT runs in __main__
+    def __getattr__(self, name):
+        if hasattr(coot, name):
+            return getattr(coot, name)
+        return getattr(__main__, name)
+
+
+class stub_coot(object):
+    # stands in for COOT when a session runs without it, e.g. to replay navigation and annotation
+    # sequences; files are read completely, so that reading them is part of any timings, and all
+    # other functions only count how often they were called
+    def __init__(self):
+        self.molecules = {}     # imol -> file name
+        self.calls = {}         # function name -> number of calls
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def call(*args):
+            self.count(name)
+        return call
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            while f.read(1024 * 1024):
+                pass
+        imol = max(self.molecules) + 1 if self.molecules else 0
+        self.molecules[imol] = filename
+        return imol
+
+    def handle_read_draw_molecule_with_recentre(self, filename, recentre):
+        self.count('handle_read_draw_molecule_with_recentre')
+        return self.read(filename)
+
+    def make_and_draw_map(self, filename, f, phi, weight, use_weights, is_diff_map):
+        self.count('make_and_draw_map')
+        return self.read(filename)
+
+    def read_ccp4_map(self, filename, is_diff_map):
+        self.count('read_ccp4_map')
+        return self.read(filename)
+
+    def auto_read_make_and_draw_maps(self, filename):
+        # 2fofc and fofc map
+        self.count('auto_read_make_and_draw_maps')
+        imol = self.read(filename)
+        self.molecules[imol + 1] = filename
+        return [imol, imol + 1]
+
+    def close_molecule(self, imol):
+        self.count('close_molecule')
+        self.molecules.pop(imol, None)
+
+    def molecule_number_list(self):
+        return sorted(self.molecules)
+
+    def molecule_name(self, imol):
+        return self.molecules.get(imol, '')
+
+    def is_valid_map_molecule(self, imol):
+        return not self.molecules.get(imol, '').endswith('.pdb')
+
+    def write_pdb_file(self, imol, filename):
+        self.count('write_pdb_file')
+        shutil.copy(self.molecules[imol], filename)
+
+
+class inspect_session(object):
+    # event inspection without GTK; all COOT functions are called through a backend, i.e. coot_backend in
+    # COOT and stub_coot elsewhere
+
+    def __init__(self, backend, logger=None, timings='inspect.timings.jsonl'):
+
+        self.logger = logger or init_logger('inspect.log')
+        self.logger.info('starting new session of pandda event map inspection')
+        # spans of loading and saving events; summarize with
+        # python inspect_pandda_analyse.py --timings inspect.timings.jsonl
+        self.timings = timing_log(timings)
+        self.coot = timed_backend(backend, self.timings)
+
+        self.index = -1
+        self.queue = []         # rows of the event table that match the selection criterion
+        self.position = -1      # position in queue
+        self.Todo = []
+        self.events = event_table()
+        self.mol_dict = {
+            'protein': None,
+            'emap': None,
+            'ligand': None
+            }
+
+        self.panddaDir = None
+        self.eventCSV = None
+        self.reset_params()
+        self.merged = False
+
+        self.selection_criteria = [
+            event_query('show all events'),
+            event_query('show all events - sort by cluster size', sort=['cluster_size']),
+            event_query('show all events - sort alphabetically', sort=['dtag']),
+            event_query('show not viewed events', [['viewed', '==', False]]),
+            event_query('show unassigned', [['ligand_confidence', 'contains', 'unassigned']]),
+            event_query('show no ligands bound', [['ligand_confidence', 'contains', 'no ligand bound']]),
+            event_query('show unknown ligands', [['ligand_confidence', 'contains', 'unknown ligand']]),
+            event_query('show low confidence ligands', [['ligand_confidence', 'contains', 'low confidence']]),
+            event_query('show high confidence ligands', [['ligand_confidence', 'contains', 'high confidence']])
+        ]
+
+        self.selected_selection_criterion = None
+
+        # annotations are appended to a journal file and only written to pandda_inspect_events.csv
+        # after this many changes and when the window is closed
+        self.journal_compact_interval = 50
+        self.journal_entries = 0
+
+        # pandda_inspect_session.pickle is ignored if it was written by a different version
+        self.snapshot_version = 1
+
+        # number of events that are logged at DEBUG level when a folder is opened
+        self.log_event_limit = 100
+
+        # number of upcoming events whose files are copied to local storage in the background
+        self.prefetch_depth = 3
+        self.directory_index = directory_index(self.logger)
+        self.file_cache = file_cache(self.logger)
+        self.molecule_cache = molecule_cache(self.logger, self.coot)
+        self.map_converter = map_converter(self.logger, self.file_cache)
+        self.prefetcher = event_prefetcher(self.logger, self.find_event_files, self.file_cache, self.map_converter)
+
+    def annotation_journal(self):
+        return os.path.join(self.analysis_folder, 'pandda_inspect_events.journal')
+
+    def session_snapshot(self):
+        return os.path.join(self.analysis_folder, 'pandda_inspect_session.pickle')
+
+    def session_position(self):
+        return os.path.join(self.analysis_folder, 'pandda_inspect_position.json')
+
+    @timed
+    def save_pandda_inspect_events_csv_file(self):
+        self.logger.info('updating {0!s}'.format(os.path.join(self.analysis_folder, 'pandda_inspect_events.csv')))
+        write_csv_file(os.path.join(self.analysis_folder, 'pandda_inspect_events.csv'), self.events.rows())
+        if os.path.isfile(self.annotation_journal()):
+            os.remove(self.annotation_journal())
+        self.journal_entries = 0
+        self.save_session_snapshot()
+
+    def csv_file_signature(self):
+        signature = []
+        for filename in (self.eventCSV, self.siteCSV):
+            s = os.stat(filename)
+            signature.append([filename, s.st_size, s.st_mtime])
+        return signature
+
+    @timed
+    def save_session_snapshot(self):
+        # event table, file index and position in the event list; used instead of the CSV files when the
+        # folder is opened again, as long as the CSV files did not change in the meantime
+        snapshot = {
+            'version': self.snapshot_version,
+            'python': sys.version_info[0],
+            'csv': self.csv_file_signature(),
+            'events': self.events.state(),
+            'sites': self.slist,
+            'folders': self.directory_index.state(),
+            'selection': self.selected_selection_criterion,
+            'queue': self.queue,
+            'position': self.position
+        }
+        filename = self.session_snapshot()
+        try:
+            fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(filename), dir=os.path.dirname(filename))
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+            move_into_place(tmp, filename)
+        except (IOError, OSError) as e:
+            self.logger.warning('cannot write {0!s}: {1!s}'.format(filename, e))
+
+    @timed
+    def load_session_snapshot(self):
+        filename = self.session_snapshot()
+        if not os.path.isfile(filename):
+            return False
+        try:
+            with open(filename, 'rb') as f:
+                snapshot = pickle.load(f)
+        except Exception as e:
+            self.logger.warning('cannot read {0!s}: {1!s}'.format(filename, e))
+            return False
+        if not isinstance(snapshot, dict) or snapshot.get('version') != self.snapshot_version or \
+                snapshot.get('python') != sys.version_info[0] or snapshot.get('csv') != self.csv_file_signature():
+            self.logger.info('{0!s} is out of date'.format(filename))
+            return False
+        self.logger.info('restoring session from {0!s}'.format(filename))
+        self.events = event_table()
+        self.events.restore(snapshot['events'])
+        self.slist = snapshot['sites']
+        self.directory_index.restore(os.path.join(self.panddaDir, 'processed_datasets'), snapshot['folders'])
+        self.selected_selection_criterion = snapshot['selection']
+        self.queue = snapshot['queue']
+        self.position = snapshot['position']
+        self.index = -1
+        self.read_saved_queries()
+        self.replay_annotation_journal()
+        self.logger.info('{0!s} events match the selection'.format(len(self.queue)))
+        self.show_content_of_event_csv_file()
+        return True
+
+    def save_position(self):
+        # selection and current event; written every time an event is loaded, because the session snapshot is
+        # only saved when the window is closed and is lost if COOT crashes or is closed directly
+        position = {'selection': self.selected_selection_criterion, 'dtag': None, 'event': None}
+        if 0 <= self.position < len(self.queue):
+            row = self.queue[self.position]
+            position['dtag'] = self.events.get(row, 'dtag')
+            position['event'] = self.events.get(row, 'event')
+        filename = self.session_position()
+        try:
+            fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(filename), dir=os.path.dirname(filename))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(position, f)
+            move_into_place(tmp, filename)
+        except (IOError, OSError) as e:
+            self.logger.warning('cannot write {0!s}: {1!s}'.format(filename, e))
+
+    def restore_position(self):
+        # applies the last saved selection and event on top of the session snapshot or the CSV files
+        filename = self.session_position()
+        if not os.path.isfile(filename):
+            return
+        try:
+            with open(filename) as f:
+                position = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            self.logger.warning('cannot read {0!s}: {1!s}'.format(filename, e))
+            return
+        if not isinstance(position, dict):
+            return
+        name = position.get('selection')
+        if name not in [q.name for q in self.selection_criteria]:
+            return
+        if name != self.selected_selection_criterion or not self.queue:
+            self.select(name)
+        row = self.events.row_of_event.get((position.get('dtag'), position.get('event')))
+        if row in self.queue:
+            self.position = self.queue.index(row)
+            self.logger.info('continuing with {0!s} - event: {1!s}'.format(position['dtag'], position['event']))
+        self.save_position()
+
+    @timed
+    def save_annotation(self, name, value):
+        # only the changed cell is appended to the journal
+        if self.events.get(self.index, name) == value:
+            return
+        self.events.set(self.index, name, value)
+        if name == 'ligand_confidence':
+            self.update_event_selector_row(self.index)
+        with open(self.annotation_journal(), 'a') as f:
+            writer = csv.writer(f)
+            writer.writerow([self.events.get(self.index, 'dtag'), self.events.get(self.index, 'event'),
+                             self.events.label(name), value])
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_entries += 1
+        if self.journal_entries >= self.journal_compact_interval:
+            self.save_pandda_inspect_events_csv_file()
+
+    @timed
+    def replay_annotation_journal(self):
+        # annotations that did not make it into pandda_inspect_events.csv, e.g. because COOT crashed
+        if not os.path.isfile(self.annotation_journal()):
+            return
+        self.logger.info('applying annotations from {0!s}'.format(self.annotation_journal()))
+        with open(self.annotation_journal()) as f:
+            lines = f.readlines()
+        if lines and not lines[-1].endswith('\n'):
+            self.logger.warning('ignoring incomplete last line of {0!s}'.format(self.annotation_journal()))
+            lines = lines[:-1]
+        rows = self.events.row_of_event
+        for record in csv.reader(lines):
+            if len(record) == 4 and (record[0], record[1]) in rows and record[2] in self.events.header:
+                self.events.set(rows[(record[0], record[1])], record[2], record[3])
+        self.save_pandda_inspect_events_csv_file()
+
+    def save_event_as_viewed(self):
+        self.save_annotation('viewed', 'True')
+
+    @timed
+    def open_pandda_folder(self, panddaDir):
+        self.panddaDir = panddaDir
+        self.selected_selection_criterion = None
+        self.queue = []
+        self.position = -1
+        self.index = -1
+
+        self.analysis_folder = ''
+        if os.path.isdir(os.path.join(self.panddaDir, 'results')):
+            self.analysis_folder = os.path.join(self.panddaDir, 'results')
+        elif os.path.isdir(os.path.join(self.panddaDir, 'analyses')):
+            self.analysis_folder = os.path.join(self.panddaDir, 'analyses')
+        elif os.path.isdir(os.path.join(self.panddaDir, 'analysis')):
+            self.analysis_folder = os.path.join(self.panddaDir, 'analysis')
+
+        self.eventCSV = os.path.realpath(os.path.join(self.analysis_folder, 'pandda_inspect_events.csv'))
+        self.siteCSV = os.path.realpath(os.path.join(self.analysis_folder, 'pandda_inspect_sites.csv'))
+
+        events = None
+        if not os.path.isfile(self.eventCSV):
+            analyse_csv = self.eventCSV.replace('pandda_inspect_events.csv', 'pandda_analyse_events.csv')
+            if not os.path.isfile(analyse_csv):
+                self.logger.error('something went wrong; cannot find {0!s}'.format(analyse_csv))
+                return False
+            else:
+                events = self.initialize_inspect_events_csv_file(analyse_csv)
+
+        if not os.path.isfile(self.eventCSV):
+            self.logger.error('something went wrong; cannot find {0!s}'.format(self.eventCSV))
+            return False
+
+        if not os.path.isfile(self.siteCSV):
+            analyse_csv = self.siteCSV.replace('pandda_inspect_sites.csv', 'pandda_analyse_sites.csv')
+            if not os.path.isfile(analyse_csv):
+                self.logger.error('something went wrong; cannot find {0!s}'.format(analyse_csv))
+                return False
+            else:
+                self.initialize_inspect_sites_csv_file(analyse_csv)
+
+        if not os.path.isfile(self.siteCSV):
+            self.logger.error('something went wrong; cannot find {0!s}'.format(self.siteCSV))
+            return False
+
+        if events is not None or not self.load_session_snapshot():
+            self.parsepanddaDir(events)
+        self.restore_position()
+        return True
+
+    def pdb_candidates(self, xtal):
+        return [
+            os.path.join(self.panddaDir, 'processed_datasets', xtal, 'modelled_structures',
+                         '{0!s}-pandda-model.pdb'.format(xtal)),
+            os.path.join(self.panddaDir, 'processed_datasets', xtal, '{0!s}-pandda-input.pdb'.format(xtal))
+        ]
+
+    def emap_candidates(self, xtal, event, bdc):
+        event_number = (3 - len(str(event))) * '0' + str(event)
+        return [
+            os.path.join(self.panddaDir, 'processed_datasets', xtal,
+                         '{0!s}-event_{1!s}_1-BDC_{2!s}_map.native.mtz'.format(xtal, event, bdc)),
+            os.path.join(self.panddaDir, 'processed_datasets', xtal,
+                         '{0!s}-event_{1!s}_1-BDC_{2!s}_map.native.ccp4'.format(xtal, event, bdc)),
+            os.path.join(self.panddaDir, 'processed_datasets', xtal,
+                         '{0!s}-pandda-output-event-{1!s}.mtz'.format(xtal, event_number))
+        ]
+
+    def zmap_candidates(self, xtal):
+        return [
+            os.path.join(self.panddaDir, 'processed_datasets', xtal, '{0!s}-z_map.native.mtz'.format(xtal)),
+            os.path.join(self.panddaDir, 'processed_datasets', xtal, '{0!s}-z_map.native.ccp4'.format(xtal)),
+            os.path.join(self.panddaDir, 'processed_datasets', xtal, '{0!s}-pandda-output.mtz'.format(xtal))
+        ]
+
+    def xraymap_candidates(self, xtal):
+        return [
+            os.path.join(self.panddaDir, 'processed_datasets', xtal, '{0!s}-pandda-input.mtz'.format(xtal))
+        ]
+
+    def averagemap_candidates(self, xtal):
+        return [
+            os.path.join(self.panddaDir, 'processed_datasets', xtal,
+                         '{0!s}-ground-state-average-map.native.mtz'.format(xtal)),
+            os.path.join(self.panddaDir, 'processed_datasets', xtal,
+                         '{0!s}-ground-state-average-map.native.ccp4'.format(xtal)),
+            os.path.join(self.panddaDir, 'processed_datasets', xtal, '{0!s}-pandda-output.mtz'.format(xtal))
+        ]
+
+    def find_first_file(self, candidates):
+        for f in candidates:
+            if self.directory_index.isfile(f):
+                return f
+        return ''
+
+    def find_event_files(self, xtal, event, bdc):
+        # same search order as get_pdb/ get_emap/ get_zmap/ get_xraymap/ get_averagemap, but without
+        # logging or touching the GUI so that it can be used from the prefetch thread
+        self.directory_index.refresh(xtal)
+        return [
+            self.find_first_file(self.pdb_candidates(xtal)),
+            self.find_first_file(self.emap_candidates(xtal, event, bdc)),
+            self.find_first_file(self.zmap_candidates(xtal)),
+            self.find_first_file(self.xraymap_candidates(xtal)),
+            self.find_first_file(self.averagemap_candidates(xtal))
+        ]
+
+    @timed
+    def get_pdb(self, missing_files):
+        pdb = ''
+        modelled_pdb, input_pdb = self.pdb_candidates(self.xtal)
+        if self.directory_index.isfile(modelled_pdb):
+            pdb = modelled_pdb
+            self.logger.info('found pdb file in modelled_structures folder: {0!s}'.format(pdb))
+        elif self.directory_index.isfile(input_pdb):
+            pdb = input_pdb
+            self.logger.info('found pdb file: {0!s}'.format(pdb))
+        else:
+            self.logger.error('did not find pdb file')
+            missing_files = True
+        return pdb, missing_files
+
+    @timed
+    def load_pdb(self):
+        key = self.molecule_cache.key(self.xtal, 'protein', self.pdb)
+        imol = self.molecule_cache.get(key)
+        if imol is not None:
+            self.logger.info('reusing protein model of {0!s}'.format(self.xtal))
+            self.coot.set_mol_displayed(imol, 1)
+        else:
+            self.coot.set_nomenclature_errors_on_read("ignore")
+            imol = self.coot.handle_read_draw_molecule_with_recentre(self.file_cache.get(self.pdb), 0)
+            self.molecule_cache.add(key, imol)
+        self.mol_dict['protein'] = imol
+        self.coot.set_show_symmetry_master(1)  # master switch to show symmetry molecules
+        self.coot.set_show_symmetry_molecule(imol, 1)  # show symm for model
+
+    @timed
+    def get_emap(self, missing_files):
+        emap = ''
+        new_pandda_output = False
+        native_mtz, native_ccp4, pandda2_mtz = self.emap_candidates(self.xtal, self.event, self.bdc)
+        if self.directory_index.isfile(native_mtz):
+            emap = native_mtz
+            self.logger.info('found event map: {0!s}'.format(emap))
+        elif self.directory_index.isfile(native_ccp4):
+            emap = native_ccp4
+            self.logger.info('found event map: {0!s}'.format(emap))
+        elif self.directory_index.isfile(pandda2_mtz):
+            emap = pandda2_mtz
+            self.logger.info('found event map: {0!s}'.format(emap))
+            new_pandda_output = True
+        else:
+            emap = native_mtz
+            self.logger.error('cannot find event map {0!s}'.format(emap))
+            self.logger.info('REMINDER: make sure that all CCP4 maps are converted into MTZ format!')
+            missing_files = True
+        self.logger.info('new pandda file names: {0!s}'.format(new_pandda_output))
+        return emap, new_pandda_output, missing_files
+
+    @timed
+    def load_emap(self):
+        emap = self.file_cache.get(self.emap)
+        if self.new_pandda_output:
+#            imol = self.coot.map_from_mtz_by_calc_phases(self.emap, "FEVENT", "PHEVENT", self.mol_dict['protein'])
+            imol = self.coot.make_and_draw_map(emap, "FEVENT", "PHEVENT", "1", 0, 0)
+            self.mol_dict['emap'] = imol
+        elif self.emap.endswith(".ccp4"):
+            imol = self.coot.read_ccp4_map(emap, 0)
+            self.mol_dict['emap'] = imol
+        else:
+            # loads double-maps
+#            imol = self.coot.auto_read_make_and_draw_maps(self.emap)
+            # testing this command
+            imol = self.coot.make_and_draw_map(emap, "FWT", "PHWT", "1", 0, 0)
+            self.mol_dict['emap'] = imol
+            # may cause core dump
+#            imol = self.coot.map_from_mtz_by_calc_phases(self.emap, "FWT", "PHWT", self.mol_dict['protein'])
+#            self.mol_dict['emap'] = imol
+        self.coot.set_colour_map_rotation_on_read_pdb(0)
+        self.coot.set_last_map_colour(0, 0, 1)
+        self.show_emap = 1
+        # event map contour level:
+        # if you divide it by (1-bdc) you get the contour level in RMSD.
+        # for 1-bdc = 0.3, then contouring at 0.3 is 1 RMSD, 0.6 is 2 RMSD, etc.
+        # note self.bdc is actually 1-bdc; however, that seems far too low in practice
+        # emap_level = 1.0 - float(self.bdc)
+        self.coot.set_contour_level_in_sigma(self.mol_dict['emap'], 1.0 - float(self.bdc))
+
+    @timed
+    def get_zmap(self, missing_files):
+        zmap = self.find_first_file(self.zmap_candidates(self.xtal))
+        if zmap:
+            self.logger.info('found z-map map: {0!s}'.format(zmap))
+        else:
+            self.logger.error('cannot find z-map!!!')
+            missing_files = True
+        return zmap, missing_files
+
+    @timed
+    def load_zmap(self):
+        self.show_zmap = 1
+        key = self.molecule_cache.key(self.xtal, 'zmap', self.zmap)
+        if self.molecule_cache.get(key) is not None:
+            self.logger.info('reusing z-map of {0!s}'.format(self.xtal))
+            self.mol_dict['zmap'] = self.molecule_cache.get(key)
+            self.coot.toggle_display_map(self.mol_dict['zmap'], self.show_zmap)
+            return
+        zmap = self.file_cache.get(self.zmap)
+        self.coot.set_default_initial_contour_level_for_difference_map(3)
+        if self.new_pandda_output:
+#            imol = self.coot.map_from_mtz_by_calc_phases(self.zmap, "FZVALUES", "PHZVALUES", self.mol_dict['protein'])
+            imol = self.coot.make_and_draw_map(zmap, "FZVALUES", "PHZVALUES", "1", 0, 1)
+            self.mol_dict['zmap'] = imol
+            self.coot.set_map_is_difference_map(imol, True)
+        elif self.zmap.endswith(".ccp4"):
+            imol = self.coot.read_ccp4_map(zmap, 1)
+            self.mol_dict['zmap'] = imol
+        else:
+            # load double-maps
+            imol = self.coot.auto_read_make_and_draw_maps(zmap)
+            self.mol_dict['zmap'] = imol[0]
+            self.coot.set_contour_level_in_sigma(self.mol_dict['zmap'], 3)
+            # may cause core dump
+#            imol = self.coot.map_from_mtz_by_calc_phases(self.zmap, "DELWT", "PHDELWT", self.mol_dict['protein'])
+#            self.mol_dict['zmap'] = imol
+#            self.coot.set_map_is_difference_map(imol, True)
+#        self.coot.set_contour_level_in_sigma(imol[0], 3)
+        self.molecule_cache.add(key, self.mol_dict['zmap'])
+
+    @timed
+    def get_xraymap(self, missing_files):
+        xraymap = self.find_first_file(self.xraymap_candidates(self.xtal))
+        if xraymap:
+            self.logger.info('found xray map: {0!s}'.format(xraymap))
+        else:
+            self.logger.error('did not find xray map')
+            missing_files = True
+        return xraymap, missing_files
+
+    @timed
+    def load_xraymap(self):
+        key = self.molecule_cache.key(self.xtal, 'xraymap', self.xraymap)
+        imol = self.molecule_cache.get(key)
+        if imol is not None:
+            self.logger.info('reusing (2)fofc maps of {0!s}'.format(self.xtal))
+        else:
+            imol = self.coot.auto_read_make_and_draw_maps(self.file_cache.get(self.xraymap))
+            self.molecule_cache.add(key, imol)
+        self.mol_dict['xraymap'] = imol
+        self.coot.set_colour_map_rotation_on_read_pdb(0)
+        self.coot.toggle_display_map(self.mol_dict['xraymap'][0], self.show_xraymap)
+        self.coot.toggle_display_map(self.mol_dict['xraymap'][1], self.show_xraymap)
+#        self.coot.set_last_map_colour(0, 0, 1)
+
+    @timed
+    def get_averagemap(self):
+        averagemap = self.find_first_file(self.averagemap_candidates(self.xtal))
+        if averagemap:
+            self.logger.info('found average map: {0!s}'.format(averagemap))
+        else:
+            self.logger.warning('did not find average map')
+        self.set_average_map_available(averagemap != '')
+        return averagemap
+
+    @timed
+    def load_averagemap(self):
+        if self.new_pandda_output:
+            key = self.molecule_cache.key(self.xtal, 'averagemap', self.zmap)
+        else:
+            key = self.molecule_cache.key(self.xtal, 'averagemap', self.averagemap)
+        if self.molecule_cache.get(key) is not None:
+            self.logger.info('reusing average map of {0!s}'.format(self.xtal))
+            self.mol_dict['averagemap'] = self.molecule_cache.get(key)
+            self.coot.toggle_display_map(self.mol_dict['averagemap'], self.show_averagemap)
+            return
+        if self.new_pandda_output:
+#            imol = self.coot.map_from_mtz_by_calc_phases(self.zmap, "FGROUND", "PHGROUND", self.mol_dict['protein'])
+            imol = self.coot.make_and_draw_map(self.file_cache.get(self.zmap), "FGROUND", "PHGROUND", "1", 0, 0)
+            self.mol_dict['averagemap'] = imol
+        elif self.averagemap.endswith(".ccp4"):
+            imol = self.coot.read_ccp4_map(self.file_cache.get(self.averagemap), 0)
+            self.mol_dict['averagemap'] = imol
+        else:
+            # loads double-maps
+            imol = self.coot.auto_read_make_and_draw_maps(self.file_cache.get(self.averagemap))
+            self.mol_dict['averagemap'] = imol[0]
+            # may case core-dump
+#            imol = self.coot.map_from_mtz_by_calc_phases(self.zmap, "FWT", "PHWT", self.mol_dict['protein'])
+#            self.mol_dict['averagemap'] = imol
+        self.molecule_cache.add(key, self.mol_dict['averagemap'])
+        self.coot.set_colour_map_rotation_on_read_pdb(0)
+        self.coot.toggle_display_map(self.mol_dict['averagemap'], self.show_averagemap)
+        self.coot.set_last_map_colour(0, 0, 1)
+
+    @timed
+    def get_ligcif(self):
+        foundCIF = False
+        ligcif = ''
+        if self.event:
+            if self.directory_index.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal, self.event, 'rhofit', 'best.cif')):
+                ligcif = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, self.event, 'rhofit', 'best.cif')
+                self.logger.info('found ligand cif file: {0!s}'.format(ligcif))
+                foundCIF = True
+        if not foundCIF:
+            for l in self.directory_index.files(os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'ligand_files'), 'cif'):
+                ligcif = l
+                self.logger.info('found ligand cif file: {0!s}'.format(ligcif))
+                foundCIF = True
+                break
+        if not foundCIF:
+            self.logger.warning('did not find ligand cif file! Check if this folder contains any files: {0!s}'.format(
+                os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'ligand_files')))
+        return ligcif
+
+    @timed
+    def load_ligcif(self):
+        if os.path.isfile(self.ligcif):
+            self.coot.read_cif_dictionary(os.path.join(self.ligcif))
+            imol = self.coot.handle_read_draw_molecule_with_recentre(self.ligcif.replace('.cif','.pdb'), 0)
+#            imol = self.coot.handle_read_draw_molecule_with_recentre(self.ligcif.replace('.cif', '.pdb'), 1)
+            self.mol_dict['ligand'] = imol
+            self.coot.seqnum_from_serial_number(imol, "X", 0)
+            self.coot.set_b_factor_residue_range(imol, "X", 1, 1, 20.00)
+            self.coot.set_occupancy_residue_range(imol, "X", 1, 1, float(self.bdc))
+
+    def convert_ccp4_map(self, ccp4):
+        if ccp4.endswith('.ccp4') and self.map_converter.available():
+            self.logger.info('{0!s} is only available in CCP4 format; converting it to MTZ format '
+                             'in the background'.format(ccp4))
+            self.map_converter.schedule(ccp4, 0)
+
+    def recentre_on_event(self):
+        self.coot.set_rotation_centre(self.x, self.y, self.z)
+
+    def reset_params(self):
+        self.xtal = None
+        self.event = None
+        self.bdc = None
+        self.site = None
+        self.pdb = None
+        self.emap = None
+        self.new_pandda_output = False
+        self.zmap = None
+        self.xraymap = None
+        self.averagemap = None
+        self.ligcif = None
+        self.x = None
+        self.y = None
+        self.z = None
+        self.resolution = None
+        self.r_free = None
+        self.r_work = None
+        self.ligand_confidence = None
+        self.merged = False
+
+    @timed
+    def update_params(self):
+        missing_files = False
+        self.xtal = self.events.get(self.index, 'dtag')
+        self.event = self.events.get(self.index, 'event')
+        self.bdc = self.events.get(self.index, 'bdc')
+        self.site = self.events.get(self.index, 'site')
+        self.logger.info('checking if files exist for  {0!s}, event: {1!s}, site: {2!s}'.format(self.xtal, self.event,
+                                                                                          self.site))
+        self.directory_index.refresh(self.xtal)
+        self.pdb, missing_files = self.get_pdb(missing_files)
+        self.emap, self.new_pandda_output, missing_files = self.get_emap(missing_files)
+        self.zmap, missing_files = self.get_zmap(missing_files)
+        self.xraymap, missing_files = self.get_xraymap(missing_files)
+        self.averagemap = self.get_averagemap()
+        for ccp4 in [self.emap, self.zmap, self.averagemap]:
+            self.convert_ccp4_map(ccp4)
+        self.ligcif = self.get_ligcif()
+        self.x = self.events.value(self.index, 'x')
+        self.y = self.events.value(self.index, 'y')
+        self.z = self.events.value(self.index, 'z')
+        self.logger.info('event coordinates -> x = {0!s}, y = {1!s}, z = {2!s}'.format(self.x, self.y, self.z))
+        self.resolution = self.events.get(self.index, 'resolution')
+        self.r_free = self.events.get(self.index, 'r_free')
+        self.r_work = self.events.get(self.index, 'r_work')
+        self.ligand_confidence = self.events.get(self.index, 'ligand_confidence')
+        return missing_files
+
+    def prefetch_next_events(self):
+        events = []
+        for row in self.queue[self.position + 1:self.position + 1 + self.prefetch_depth]:
+            events.append((self.events.get(row, 'dtag'), self.events.get(row, 'event'),
+                           self.events.get(row, 'bdc')))
+        self.prefetcher.schedule(events)
+
+    def has_unsaved_changes(self, imol):
+        try:
+            return bool(self.coot.have_unsaved_changes_p(imol))
+        except AttributeError:
+            return False
+
+    def close_molecules(self):
+        # cached molecules are only hidden; they are shown again if the next event belongs to the same dataset;
+        # models that were changed but not saved are closed, so that the next event reads the file again
+        for imol in self.coot.molecule_number_list():
+            if self.molecule_cache.contains(imol) and not self.coot.is_valid_map_molecule(imol) and \
+                    self.has_unsaved_changes(imol):
+                self.logger.info('closing model with unsaved changes: {0!s}'.format(imol))
+                self.molecule_cache.discard(imol)
+            if not self.molecule_cache.contains(imol):
+                self.coot.close_molecule(imol)
+            elif self.coot.is_valid_map_molecule(imol):
+                self.coot.toggle_display_map(imol, 0)
+            else:
+                self.coot.set_mol_displayed(imol, 0)
+
+    @timed
+    def RefreshData(self, step=1):
+        # step is the direction in which events with missing files are skipped
+
+        if not self.queue:
+            self.logger.warning('no events match the selection criterion')
+            return None
+        if self.position < 0:
+            self.position = 0
+        if self.position > len(self.queue) - 1:
+            self.position = len(self.queue) - 1
+            self.logger.warning('you reached the end of available events!')
+            return None
+
+        self.reset_params()
+
+        self.close_molecules()
+
+        self.mol_dict = {
+            'pdb': None,
+            'emap': None,
+            'zmap': None,
+            'ligand': None,
+            'xraymap': None,
+            'averagemap': None
+            }
+
+        self.show_emap = 0
+        self.show_zmap = 0
+        self.show_xraymap = 0
+        self.show_averagemap = 0
+
+        # events with missing files are skipped without recursing back into RefreshData
+        while True:
+            self.index = self.queue[self.position]
+            missing_files = self.update_params()
+            if not missing_files:
+                break
+            self.logger.error('essential files could not be found, check messages above; skipping...')
+            if step < 0 and self.position == 0:
+                self.logger.warning('you reached the first of the available events!')
+                return None
+            if step >= 0 and self.position == len(self.queue) - 1:
+                self.logger.warning('you reached the end of available events!')
+                return None
+            self.position += -1 if step < 0 else 1
+        self.update_progressbar()
+        self.update_event_selector()
+        self.save_position()
+
+        self.logger.info('loading files for {0!s}, event: {1!s}, site: {2!s}'.format(self.xtal, self.event, self.site))
+        self.set_ligand_confidence_button()
+        self.update_labels()
+        self.recentre_on_event()
+        self.load_ligcif()
+        self.load_pdb()
+        self.load_emap()
+        self.load_zmap()
+        self.load_xraymap()
+        if self.averagemap:
+            self.load_averagemap()
+        self.logger.info('setting event map as RSR map')
+        self.coot.set_imol_refinement_map(self.mol_dict['emap'])
+        self.molecule_cache.evict(self.xtal)
+        self.prefetch_next_events()
 
-import gtk
-import coot
-import __main__
+    def check_if_modelled_structures_folder_exists(self):
+        modelled_structures = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'modelled_structures')
+        if not os.path.isdir(os.path.join(modelled_structures)):
+            self.logger.info('creating folder {0!s}'.format(modelled_structures))
+            os.mkdir(modelled_structures)
 
-import csv
-import logging
+    @timed
+    def save_model(self):
+        # writes the protein model as the next fitted-vNNNN.pdb and copies it to <xtal>-pandda-model.pdb
+        self.check_if_modelled_structures_folder_exists()
+        modelled_structures = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'modelled_structures')
+        versions = [0]
+        for p in glob.glob(os.path.join(modelled_structures, 'fitted-v*.pdb')):
+            try:
+                versions.append(int(os.path.basename(p)[len('fitted-v'):-len('.pdb')]))
+            except ValueError:
+                pass
+        new = os.path.join(modelled_structures, 'fitted-v{0:04d}.pdb'.format(max(versions) + 1))
+        self.coot.write_pdb_file(self.mol_dict['protein'], new)
+        pandda_model = os.path.join(modelled_structures, '{0!s}-pandda-model.pdb'.format(self.xtal))
+        if os.path.isfile(pandda_model):
+            os.remove(pandda_model)
+        shutil.copy(new, pandda_model)
+        if self.merged:
+            self.save_annotation('ligand_placed', 'True')
+        return new
+
+    @timed
+    def select(self, name):
+        self.selected_selection_criterion = name
+        query = None
+        for q in self.selection_criteria:
+            if q.name == self.selected_selection_criterion:
+                query = q
+        if query is None:
+            return
+        self.logger.info("you selected to {0!s}".format(self.selected_selection_criterion))
+        try:
+            self.queue = query.select(self.events)
+        except ValueError as e:
+            self.logger.error('cannot use selection {0!s}: {1!s}'.format(query.name, e))
+            return
+        if query.sort:
+            self.logger.info("sorting events by {0!s}".format(', '.join(query.sort)))
+            self.init_event_selector()
+        self.logger.info("{0!s} of {1!s} events match the selection".format(len(self.queue), len(self.events)))
+        self.index = -1
+        self.position = -1
+        self.save_position()
 
-def init_logger(logfile):
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s | %(levelname)s - INSPECT | %(message)s', '%m-%d-%Y %H:%M:%S')
+    def resume(self):
+        # shows the event that was selected when the session snapshot was saved
+        names = [q.name for q in self.selection_criteria]
+        if self.queue and self.position >= 0 and self.selected_selection_criterion in names:
+            self.logger.info('continuing with {0!s}'.format(self.selected_selection_criterion))
+            self.set_selection(names.index(self.selected_selection_criterion))
+            self.RefreshData()
 
-    stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setLevel(logging.DEBUG)
-    stdout_handler.setFormatter(formatter)
-    logger.addHandler(stdout_handler)
+    def change_site(self, n):
+        current_site = int(self.site)
+        self.logger.info('current site {0!s}'.format(current_site))
+        new_site = current_site + n
+        self.logger.info('new site: {0!s}'.format(new_site))
+        if new_site in self.events.rows_of_site:
+            self.change_to_row(self.events.rows_of_site[new_site][0])
 
-    file_handler = logging.FileHandler(logfile)
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    def change_event(self, n):
+        # one step before the first or after the last event at most, so that the other direction
+        # gets back to the events straight away
+        self.position = max(-1, min(self.position + n, len(self.queue)))
+        self.RefreshData(n)
+
+    def change_to_row(self, row):
+        # moves to the given row, or to the next selected event if the row is not part of the selection
+        if row == self.index:
+            return
+        self.position = bisect.bisect_left(self.queue, row)
+        self.RefreshData()
 
-    return logger
+    def replay(self, actions):
+        # runs a sequence of actions, e.g. [['select', 'show all events'], ['next'],
+        # ['annotate', 'ligand_confidence', 'high confidence'], ['next']], and returns how long each took
+        steps = {
+            'select': self.select,
+            'next': lambda: self.change_event(1),
+            'previous': lambda: self.change_event(-1),
+            'next_site': lambda: self.change_site(1),
+            'previous_site': lambda: self.change_site(-1),
+            'annotate': self.save_annotation,
+            'viewed': self.save_event_as_viewed,
+            'save_model': self.save_model
+        }
+        timings = []
+        for action in actions:
+            start = time.time()
+            steps[action[0]](*action[1:])
+            timings.append((action[0], time.time() - start))
+        return timings
 
+    def make_secure_copy_of_original_csv(self, csv_file):
+        csv_original = csv_file + '.original'
+        if not os.path.isfile(csv_original):
+            self.logger.info('creating backup file of {0!s}'.format(csv_file))
+            shutil.copy(csv_file, csv_original)
 
-class inspect_gui(object):
+    @timed
+    def initialize_inspect_events_csv_file(self, analyse_csv):
+        # returns the events of the new file, or None if they cannot be used
+        self.make_secure_copy_of_original_csv(analyse_csv)
+        events = event_table()
+        convert_analyse_csv(analyse_csv, os.path.join(self.analysis_folder, 'pandda_inspect_events.csv'),
+                            ['Interesting', 'Ligand Placed', 'Ligand Confidence', 'Comment', 'Viewed'],
+                            ['False', 'False', 'Low', 'None', 'False'], events)
+        try:
+            events.resolve_header()
+        except ValueError:
+            return None
+        return events
 
-    def __init__(self):
+    @timed
+    def initialize_inspect_sites_csv_file(self, analyse_csv):
+        self.make_secure_copy_of_original_csv(analyse_csv)
+        convert_analyse_csv(analyse_csv, os.path.join(self.analysis_folder, 'pandda_inspect_sites.csv'),
+                            ['Name', 'Comment'], ['None', 'None'])
+
+    @timed
+    def parsepanddaDir(self, events=None):
+        # events are only read if they were not just created from pandda_analyse_events.csv
+        self.directory_index.build(os.path.join(self.panddaDir, 'processed_datasets'))
+
+        if events is None:
+            self.logger.info("reading {0!s}".format(self.eventCSV))
+            events = event_table()
+            try:
+                events.read(self.eventCSV)
+            except ValueError as e:
+                self.logger.error('cannot use {0!s}: {1!s}'.format(self.eventCSV, e))
+                self.events = event_table()
+                return
+        self.events = events
 
-        self.logger = init_logger('inspect.log')
-        self.logger.info('starting new session of pandda event map inspection')
+        self.logger.info("reading {0!s}".format(self.siteCSV))
+        with open(self.siteCSV) as f:
+            self.slist = list(csv.reader(f))
 
-        self.index = -1
-        self.Todo = []
-        self.cb_list = []
-        self.mol_dict = {
-            'protein': None,
-            'emap': None,
-            'ligand': None
-            }
+        self.read_saved_queries()
+        self.replay_annotation_journal()
+        self.show_content_of_event_csv_file()
+        self.save_session_snapshot()
+
+    def read_saved_queries(self):
+        # named event selections in the analysis folder are added to the available selections, e.g.
+        # {"unviewed high confidence ligands": {"where": [["ligand_confidence", "contains", "high confidence"],
+        #                                                  ["viewed", "==", false]],
+        #                                        "sort": ["-z_peak"]}}
+        queries_file = os.path.join(self.analysis_folder, 'pandda_inspect_queries.json')
+        if not os.path.isfile(queries_file):
+            return
+        self.logger.info("reading {0!s}".format(queries_file))
+        try:
+            with open(queries_file) as f:
+                saved = json.load(f, object_pairs_hook=OrderedDict)
+        except ValueError as e:
+            self.logger.error('cannot read {0!s}: {1!s}'.format(queries_file, e))
+            return
+        names = [q.name for q in self.selection_criteria]
+        for name in saved:
+            if name in names:
+                self.logger.warning('event selection {0!s} exists already; skipping'.format(name))
+                continue
+            try:
+                query = event_query(name, saved[name].get('where'), saved[name].get('sort'))
+            except (ValueError, TypeError, AttributeError) as e:
+                self.logger.error('cannot use event selection {0!s}: {1!s}'.format(name, e))
+                continue
+            self.logger.info('adding event selection {0!s}'.format(name))
+            self.selection_criteria.append(query)
+            self.add_selection(name)
 
-        self.panddaDir = None
-        self.eventCSV = None
-        self.reset_params()
-        self.merged = False
+    def show_content_of_event_csv_file(self):
+        # a summary of the events; every event is only logged at DEBUG level, and at most log_event_limit of them
+        dtags = self.events.data[self.events.position['dtag']]
+        self.logger.info('{0!s} events in {1!s} datasets and {2!s} sites; {3!s} viewed'.format(
+            len(self.events), len(set(dtags)), len(self.events.rows_of_site), sum(self.events.typed['viewed'])))
+        count = [0] * len(self.events.categories['ligand_confidence'])
+        for code in self.events.typed['ligand_confidence']:
+            count[code] += 1
+        self.logger.info('ligand confidence: {0!s}'.format(', '.join(
+            '{0!s}: {1!s}'.format(c, n) for c, n in zip(self.events.categories['ligand_confidence'], count))))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("showing contents of {0!s}:".format(self.eventCSV))
+            for n in range(min(len(self.events), self.log_event_limit)):
+                x = round(self.events.value(n, 'x'), 1)
+                y = round(self.events.value(n, 'y'), 1)
+                z = round(self.events.value(n, 'z'), 1)
+                info = (
+                    ' xtal: {0!s}'.format(self.events.get(n, 'dtag')) +
+                    ' - event/site: {0!s}/{1!s}'.format(self.events.get(n, 'event'), self.events.get(n, 'site')) +
+                    ' - BDC: {0!s}'.format(self.events.get(n, 'bdc')) +
+                    ' - x,y,z: {0!s},{1!s},{2!s}'.format(x, y, z) +
+                    ' - Resolution: {0!s}'.format(self.events.get(n, 'resolution')) +
+                    ' - Rwork/Rfree: {0!s}/{1!s}'.format(self.events.get(n, 'r_work'),
+                                                        self.events.get(n, 'r_free')) +
+                    ' - viewed: {0!s}'.format(self.events.get(n, 'viewed')) +
+                    ' - ligand confidence: {0!s}'.format(self.events.get(n, 'ligand_confidence'))
+                )
+                self.logger.debug(info)
+            if len(self.events) > self.log_event_limit:
+                self.logger.debug('... and {0!s} more events'.format(len(self.events) - self.log_event_limit))
+        self.init_event_selector()
+
+    # the following methods are called when the state of the session changes; they do nothing here and are
+    # implemented by inspect_gui to update the widgets
+
+    def update_labels(self):
+        pass
+
+    def set_ligand_confidence_button(self):
+        pass
+
+    def set_average_map_available(self, available):
+        pass
+
+    def update_progressbar(self):
+        pass
+
+    def update_event_selector(self):
+        pass
+
+    def update_event_selector_row(self, row):
+        pass
+
+    def init_event_selector(self):
+        pass
+
+    def add_selection(self, name):
+        pass
+
+    def set_selection(self, n):
+        pass
+
+
+class inspect_gui(inspect_session):
+
+    def __init__(self):
+        inspect_session.__init__(self, coot_backend())
 
 #        self.ligand_confidence_button_labels = [
 #            [0, 'unassigned'],
@@ -88,24 +1968,15 @@ class inspect_gui(object):
             [5, '2fofc map']
         ]
 
-        self.selection_criteria = [
-            'show all events',
-            'show all events - sort by cluster size',
-            'show all events - sort alphabetically',
-            'show not viewed events',
-            'show unassigned',
-            'show no ligands bound',
-            'show unknown ligands',
-            'show low confidence ligands',
-            'show high confidence ligands'
-        ]
-
-        self.selected_selection_criterion = None
-
-
     def startGUI(self):
+        try:
+            # the main loop needs to release the GIL, otherwise the prefetch thread never runs
+            import gobject
+            gobject.threads_init()
+        except (ImportError, AttributeError):
+            pass
         self.window = gtk.Window(gtk.WINDOW_TOPLEVEL)
-        self.window.connect("delete_event", gtk.main_quit)
+        self.window.connect("delete_event", self.quit)
         self.window.set_border_width(10)
         self.window.set_default_size(400, 600)
         self.window.set_title("inspect")
@@ -123,8 +1994,8 @@ class inspect_gui(object):
         hbox = gtk.HBox()
         self.select_events_combobox = gtk.combo_box_new_text()
         #        self.select_events_combobox.connect("changed", self.set_selection_mode)
-        for citeria in self.selection_criteria:
-            self.select_events_combobox.append_text(citeria)
+        for query in self.selection_criteria:
+            self.select_events_combobox.append_text(query.name)
         hbox.pack_start(self.select_events_combobox)
         select_events_button = gtk.Button(label="Go")
         select_events_button.connect("clicked", self.select_events)
@@ -212,415 +2083,127 @@ class inspect_gui(object):
         previous_site_button.connect("clicked", self.previous_site)
         hbox.pack_start(previous_site_button)
         next_site_button = gtk.Button(label="Site >>>")
-        next_site_button.connect("clicked", self.next_site)
-        hbox.pack_start(next_site_button)
-        vbox.add(hbox)
-
-        self.vbox_sample_navigator = gtk.VBox()
-        self.cb = gtk.combo_box_new_text()
-        self.cb.connect("changed", self.select_crystal)
-        vbox.add(self.cb)
-
-
-        self.crystal_progressbar = gtk.ProgressBar()
-        vbox.add(self.crystal_progressbar)
-        frame.add(vbox)
-        self.vbox.add(frame)
-
-        frame = gtk.Frame(label='Toggle Maps')
-        hbox = gtk.HBox()
-        toggle_emap_button = gtk.Button(label="event map")
-        hbox.add(toggle_emap_button)
-        toggle_emap_button.connect("clicked", self.toggle_emap)
-        toggle_zmap_button = gtk.Button(label="Z-map")
-        hbox.add(toggle_zmap_button)
-        toggle_zmap_button.connect("clicked", self.toggle_zmap)
-        toggle_x_ray_maps_button = gtk.Button(label="(2)fofc maps")
-        hbox.add(toggle_x_ray_maps_button)
-        toggle_x_ray_maps_button.connect("clicked", self.toggle_x_ray_maps)
-        self.toggle_average_map_button = gtk.Button(label="average map")
-        hbox.add(self.toggle_average_map_button)
-        self.toggle_average_map_button.connect("clicked", self.toggle_average_map)
-        frame.add(hbox)
-        self.vbox.pack_start(frame)
-
-        frame = gtk.Frame(label='Ligand Modeling')
-        hbox = gtk.HBox()
-        place_ligand_here_button = gtk.Button(label="Place Ligand here")
-        place_ligand_here_button.connect("clicked", self.place_ligand_here)
-        hbox.add(place_ligand_here_button)
-        merge_ligand_button = gtk.Button(label="Merge Ligand")
-        merge_ligand_button.connect("clicked", self.merge_ligand_into_protein)
-        hbox.add(merge_ligand_button)
-        reset_to_unfitted_button = gtk.Button(label="Revert to unfitted")
-        reset_to_unfitted_button.connect("clicked", self.reset_to_unfitted)
-        hbox.add(reset_to_unfitted_button)
-        frame.add(hbox)
-        self.vbox.pack_start(frame)
-
-        frame = gtk.Frame(label='Annotation')
-        vbox = gtk.VBox()
-        self.ligand_confidence_button_list = []
-        for n, item in enumerate(self.ligand_confidence_button_labels):
-            if n == 0:
-                button = gtk.RadioButton(None, item[1])
-            else:
-                button = gtk.RadioButton(button, item[1])
-            button.connect("toggled", self.set_ligand_confidence, item[1])
-            self.ligand_confidence_button_list.append(button)
-            vbox.add(button)
-            button.show()
-        frame.add(vbox)
-        self.vbox.pack_start(frame)
-
-        frame = gtk.Frame(label='Save')
-        hbox = gtk.HBox()
-        self.save_next_button = gtk.Button(label="Save Model")
-        hbox.add(self.save_next_button)
-        self.save_next_button.connect("clicked", self.save_next)
-        frame.add(hbox)
-        self.vbox.pack_start(frame)
-
-        self.window.add(self.vbox)
-        self.window.show_all()
-
-    def save_pandda_inspect_events_csv_file(self):
-        with open(os.path.join(self.analysis_folder, 'pandda_inspect_events.csv'), 'w') as csvfile:
-            self.logger.info('updating {0!s}'.format(os.path.join(self.analysis_folder, 'pandda_inspect_events.csv')))
-            writer = csv.writer(csvfile)
-            writer.writerows(self.elist)
-
-    def set_ligand_confidence(self, widget, data=None):
-#        for n, b in enumerate(self.ligand_confidence_button_list):
-#            print("***********",n,b.get_active())
-        if widget.get_active():
-            self.elist[self.index][self.ligand_confidence_index] = data
-            self.save_pandda_inspect_events_csv_file()
-#            with open(os.path.join(self.analysis_folder, 'pandda_inspect_events.csv'), 'w') as csvfile:
-#                print('INSPECT - INFO: updating {0!s}'.format(
-#                    os.path.join(self.analysis_folder, 'pandda_inspect_events.csv')))
-#                writer = csv.writer(csvfile)
-#                writer.writerows(self.elist)
-
-    def save_event_as_viewed(self):
-        self.elist[self.index][self.viewed_index] = 'True'
-        self.save_pandda_inspect_events_csv_file()
-
-    def set_ligand_confidence_button(self):
-        foundItem = False
-        for item in self.ligand_confidence_button_labels:
-            if item[1] == self.ligand_confidence:
-                self.ligand_confidence_button_list[item[0]].set_active(True)
-                foundItem = True
-                break
-        if not foundItem:
-            self.ligand_confidence_button_list[0].set_active(True)
-
-    def select_pandda_folder(self, widget):
-        dlg = gtk.FileChooserDialog("Open..", None, gtk.FILE_CHOOSER_ACTION_SELECT_FOLDER,
-                                    (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL, gtk.STOCK_OPEN, gtk.RESPONSE_OK))
-        response = dlg.run()
-        self.panddaDir = dlg.get_filename()
-
-        self.analysis_folder = ''
-        if os.path.isdir(os.path.join(self.panddaDir, 'results')):
-            self.analysis_folder = os.path.join(self.panddaDir, 'results')
-        elif os.path.isdir(os.path.join(self.panddaDir, 'analyses')):
-            self.analysis_folder = os.path.join(self.panddaDir, 'analyses')
-        elif os.path.isdir(os.path.join(self.panddaDir, 'analysis')):
-            self.analysis_folder = os.path.join(self.panddaDir, 'analysis')
-
-        self.eventCSV = os.path.realpath(os.path.join(self.analysis_folder, 'pandda_inspect_events.csv'))
-        self.siteCSV = os.path.realpath(os.path.join(self.analysis_folder, 'pandda_inspect_sites.csv'))
-
-        if not os.path.isfile(self.eventCSV):
-            analyse_csv = self.eventCSV.replace('pandda_inspect_events.csv', 'pandda_analyse_events.csv')
-            if not os.path.isfile(analyse_csv):
-                self.logger.error('something went wrong; cannot find {0!s}'.format(analyse_csv))
-                return
-            else:
-                self.initialize_inspect_events_csv_file(analyse_csv)
-
-        if not os.path.isfile(self.eventCSV):
-            self.logger.error('something went wrong; cannot find {0!s}'.format(self.eventCSV))
-            return
-
-        if not os.path.isfile(self.siteCSV):
-            analyse_csv = self.siteCSV.replace('pandda_inspect_sites.csv', 'pandda_analyse_sites.csv')
-            if not os.path.isfile(analyse_csv):
-                self.logger.error('something went wrong; cannot find {0!s}'.format(analyse_csv))
-                return
-            else:
-                self.initialize_inspect_sites_csv_file(analyse_csv)
-
-        if not os.path.isfile(self.siteCSV):
-            self.logger.error('something went wrong; cannot find {0!s}'.format(self.siteCSV))
-            return
-
-        dlg.destroy()
-        self.parsepanddaDir()
-
-    def get_pdb(self, missing_files):
-        if os.path.isfile(
-                os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'modelled_structures',
-                             '{0!s}-pandda-model.pdb'.format(self.xtal))):
-            pdb = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'modelled_structures',
-                             '{0!s}-pandda-model.pdb'.format(self.xtal))
-            self.logger.info('found pdb file in modelled_structures folder: {0!s}'.format(pdb))
-        elif os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                                         '{0!s}-pandda-input.pdb'.format(self.xtal))):
-            pdb = os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                               '{0!s}-pandda-input.pdb'.format(self.xtal))
-            self.logger.info('found pdb file: {0!s}'.format(pdb))
-        else:
-            self.logger.error('did not find pdb file')
-            missing_files = True
-        return pdb, missing_files
-
-    def load_pdb(self):
-        coot.set_nomenclature_errors_on_read("ignore")
-        imol = coot.handle_read_draw_molecule_with_recentre(self.pdb, 0)
-        self.mol_dict['protein'] = imol
-        coot.set_show_symmetry_master(1)  # master switch to show symmetry molecules
-        coot.set_show_symmetry_molecule(imol, 1)  # show symm for model
-
-    def get_emap(self, missing_files):
-        emap = ''
-        new_pandda_output = False
-        event_number = (3 - len(str(self.event))) * '0' + str(self.event)
-        if os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                '{0!s}-event_{1!s}_1-BDC_{2!s}_map.native.mtz'.format(self.xtal, self.event, self.bdc))):
-            emap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                '{0!s}-event_{1!s}_1-BDC_{2!s}_map.native.mtz'.format(self.xtal, self.event, self.bdc))
-            self.logger.info('found event map: {0!s}'.format(emap))
-        elif os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                '{0!s}-event_{1!s}_1-BDC_{2!s}_map.native.ccp4'.format(self.xtal, self.event, self.bdc))):
-            emap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                '{0!s}-event_{1!s}_1-BDC_{2!s}_map.native.ccp4'.format(self.xtal, self.event, self.bdc))
-            self.logger.info('found event map: {0!s}'.format(emap))
-        elif os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                '{0!s}-pandda-output-event-{1!s}.mtz'.format(self.xtal, event_number))):
-            emap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                '{0!s}-pandda-output-event-{1!s}.mtz'.format(self.xtal, event_number))
-            self.logger.info('found event map: {0!s}'.format(emap))
-            new_pandda_output = True
-        else:
-            emap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                                '{0!s}-event_{1!s}_1-BDC_{2!s}_map.native.mtz'.format(self.xtal, self.event, self.bdc))
-            self.logger.error('cannot find event map {0!s}'.format(emap))
-            self.logger.info('REMINDER: make sure that all CCP4 maps are converted into MTZ format!')
-            missing_files = True
-        self.logger.info('new pandda file names: {0!s}'.format(new_pandda_output))
-        return emap, new_pandda_output, missing_files
-
-    def load_emap(self):
-        if self.new_pandda_output:
-#            imol = coot.map_from_mtz_by_calc_phases(self.emap, "FEVENT", "PHEVENT", self.mol_dict['protein'])
-            imol = coot.make_and_draw_map(self.emap, "FEVENT", "PHEVENT", "1", 0, 0)
-            self.mol_dict['emap'] = imol
-        elif self.emap.endswith(".ccp4"):
-            imol = coot.read_ccp4_map(self.emap, 0)
-            self.mol_dict['emap'] = imol
-        else:
-            # loads double-maps
-#            imol = coot.auto_read_make_and_draw_maps(self.emap)
-            # testing this command
-            imol = coot.make_and_draw_map(self.emap, "FWT", "PHWT", "1", 0, 0)
-            self.mol_dict['emap'] = imol
-            # may cause core dump
-#            imol = coot.map_from_mtz_by_calc_phases(self.emap, "FWT", "PHWT", self.mol_dict['protein'])
-#            self.mol_dict['emap'] = imol
-        coot.set_colour_map_rotation_on_read_pdb(0)
-        coot.set_last_map_colour(0, 0, 1)
-        self.show_emap = 1
-        # event map contour level:
-        # if you divide it by (1-bdc) you get the contour level in RMSD.
-        # for 1-bdc = 0.3, then contouring at 0.3 is 1 RMSD, 0.6 is 2 RMSD, etc.
-        # note self.bdc is actually 1-bdc; however, that seems far too low in practice
-        # emap_level = 1.0 - float(self.bdc)
-        coot.set_contour_level_in_sigma(self.mol_dict['emap'], 1.0 - float(self.bdc))
+        next_site_button.connect("clicked", self.next_site)
+        hbox.pack_start(next_site_button)
+        vbox.add(hbox)
 
-    def get_zmap(self, missing_files):
-        zmap = ''
-        if os.path.isfile(
-                os.path.join(self.panddaDir, 'processed_datasets', self.xtal, '{0!s}-z_map.native.mtz'.format(self.xtal))):
-            zmap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, '{0!s}-z_map.native.mtz'.format(self.xtal))
-            self.logger.info('found z-map map: {0!s}'.format(zmap))
-        elif os.path.isfile(
-                os.path.join(self.panddaDir, 'processed_datasets', self.xtal, '{0!s}-z_map.native.ccp4'.format(self.xtal))):
-            zmap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, '{0!s}-z_map.native.ccp4'.format(self.xtal))
-            self.logger.info('found z-map map: {0!s}'.format(zmap))
-        elif os.path.isfile(
-                os.path.join(self.panddaDir, 'processed_datasets', self.xtal, '{0!s}-pandda-output.mtz'.format(self.xtal))):
-            zmap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, '{0!s}-pandda-output.mtz'.format(self.xtal))
-            self.logger.info('found z-map map: {0!s}'.format(zmap))
-        else:
-            self.logger.error('cannot find z-map!!!')
-            missing_files = True
-        return zmap, missing_files
+        self.vbox_sample_navigator = gtk.VBox()
+        # crystal, event, site and ligand confidence; one row per row of the event table, in the same order
+        self.event_store = gtk.ListStore(str, str, str, str)
+        self.event_view = gtk.TreeView(self.event_store)
+        for n, title in enumerate(['Crystal', 'Event', 'Site', 'Ligand Confidence']):
+            column = gtk.TreeViewColumn(title, gtk.CellRendererText(), text=n)
+            # fixed column sizes let the view skip measuring every row
+            column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+            column.set_fixed_width(120 if n in (0, 3) else 50)
+            self.event_view.append_column(column)
+        self.event_view.set_fixed_height_mode(True)
+        self.event_view.set_enable_search(True)
+        self.event_view.set_search_column(0)
+        self.event_view.set_search_equal_func(self.search_event)
+        # only double-click or Enter load an event; the selection also changes while typing a search
+        # or moving through the list with the arrow keys
+        self.event_view.connect("row-activated", self.select_crystal)
+        scrolled = gtk.ScrolledWindow()
+        scrolled.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolled.set_size_request(-1, 150)
+        scrolled.add(self.event_view)
+        vbox.add(scrolled)
 
-    def load_zmap(self):
-        coot.set_default_initial_contour_level_for_difference_map(3)
-        if self.new_pandda_output:
-#            imol = coot.map_from_mtz_by_calc_phases(self.zmap, "FZVALUES", "PHZVALUES", self.mol_dict['protein'])
-            imol = coot.make_and_draw_map(self.zmap, "FZVALUES", "PHZVALUES", "1", 0, 1)
-            self.mol_dict['zmap'] = imol
-            coot.set_map_is_difference_map(imol, True)
-        elif self.zmap.endswith(".ccp4"):
-            imol = coot.read_ccp4_map(self.zmap, 1)
-            self.mol_dict['zmap'] = imol
-        else:
-            # load double-maps
-            imol = coot.auto_read_make_and_draw_maps(self.zmap)
-            self.mol_dict['zmap'] = imol[0]
-            coot.set_contour_level_in_sigma(self.mol_dict['zmap'], 3)
-            # may cause core dump
-#            imol = coot.map_from_mtz_by_calc_phases(self.zmap, "DELWT", "PHDELWT", self.mol_dict['protein'])
-#            self.mol_dict['zmap'] = imol
-#            coot.set_map_is_difference_map(imol, True)
-#        coot.set_contour_level_in_sigma(imol[0], 3)
-        self.show_zmap = 1
 
-    def get_xraymap(self, missing_files):
-        xraymap = ''
-        if os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets',
-                                       self.xtal, '{0!s}-pandda-input.mtz'.format(self.xtal))):
-            xraymap = os.path.join(self.panddaDir, 'processed_datasets',
-                                   self.xtal, '{0!s}-pandda-input.mtz'.format(self.xtal))
-            self.logger.info('found xray map: {0!s}'.format(xraymap))
-        else:
-            self.logger.error('did not find xray map')
-            missing_files = True
-        return xraymap, missing_files
+        self.crystal_progressbar = gtk.ProgressBar()
+        vbox.add(self.crystal_progressbar)
+        frame.add(vbox)
+        self.vbox.add(frame)
 
-    def load_xraymap(self):
-        imol = coot.auto_read_make_and_draw_maps(self.xraymap)
-        self.mol_dict['xraymap'] = imol
-        coot.set_colour_map_rotation_on_read_pdb(0)
-        __main__.toggle_display_map(self.mol_dict['xraymap'][0], self.show_xraymap)
-        __main__.toggle_display_map(self.mol_dict['xraymap'][1], self.show_xraymap)
-#        coot.set_last_map_colour(0, 0, 1)
+        frame = gtk.Frame(label='Toggle Maps')
+        hbox = gtk.HBox()
+        toggle_emap_button = gtk.Button(label="event map")
+        hbox.add(toggle_emap_button)
+        toggle_emap_button.connect("clicked", self.toggle_emap)
+        toggle_zmap_button = gtk.Button(label="Z-map")
+        hbox.add(toggle_zmap_button)
+        toggle_zmap_button.connect("clicked", self.toggle_zmap)
+        toggle_x_ray_maps_button = gtk.Button(label="(2)fofc maps")
+        hbox.add(toggle_x_ray_maps_button)
+        toggle_x_ray_maps_button.connect("clicked", self.toggle_x_ray_maps)
+        self.toggle_average_map_button = gtk.Button(label="average map")
+        hbox.add(self.toggle_average_map_button)
+        self.toggle_average_map_button.connect("clicked", self.toggle_average_map)
+        frame.add(hbox)
+        self.vbox.pack_start(frame)
 
-    def get_averagemap(self):
-        averagemap = ''
-        if os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                                       '{0!s}-ground-state-average-map.native.mtz'.format(self.xtal))):
-            averagemap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                                      '{0!s}-ground-state-average-map.native.mtz'.format(self.xtal))
-            self.logger.info('found average map: {0!s}'.format(averagemap))
-            self.toggle_average_map_button.set_sensitive(True)
+        frame = gtk.Frame(label='Ligand Modeling')
+        hbox = gtk.HBox()
+        place_ligand_here_button = gtk.Button(label="Place Ligand here")
+        place_ligand_here_button.connect("clicked", self.place_ligand_here)
+        hbox.add(place_ligand_here_button)
+        merge_ligand_button = gtk.Button(label="Merge Ligand")
+        merge_ligand_button.connect("clicked", self.merge_ligand_into_protein)
+        hbox.add(merge_ligand_button)
+        reset_to_unfitted_button = gtk.Button(label="Revert to unfitted")
+        reset_to_unfitted_button.connect("clicked", self.reset_to_unfitted)
+        hbox.add(reset_to_unfitted_button)
+        frame.add(hbox)
+        self.vbox.pack_start(frame)
 
-        elif os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                                       '{0!s}-ground-state-average-map.native.ccp4'.format(self.xtal))):
-            averagemap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                                      '{0!s}-ground-state-average-map.native.ccp4'.format(self.xtal))
-            self.logger.info('found average map: {0!s}'.format(averagemap))
-            self.toggle_average_map_button.set_sensitive(True)
-        elif os.path.isfile(
-                os.path.join(self.panddaDir, 'processed_datasets', self.xtal, '{0!s}-pandda-output.mtz'.format(self.xtal))):
-            averagemap = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, '{0!s}-pandda-output.mtz'.format(self.xtal))
-            self.logger.info('found average map: {0!s}'.format(averagemap))
-            self.toggle_average_map_button.set_sensitive(True)
-        else:
-            self.logger.warning('did not find average map; disabling "average map" button')
-            self.toggle_average_map_button.set_sensitive(False)
-        return averagemap
+        frame = gtk.Frame(label='Annotation')
+        vbox = gtk.VBox()
+        self.ligand_confidence_button_list = []
+        for n, item in enumerate(self.ligand_confidence_button_labels):
+            if n == 0:
+                button = gtk.RadioButton(None, item[1])
+            else:
+                button = gtk.RadioButton(button, item[1])
+            button.connect("toggled", self.set_ligand_confidence, item[1])
+            self.ligand_confidence_button_list.append(button)
+            vbox.add(button)
+            button.show()
+        frame.add(vbox)
+        self.vbox.pack_start(frame)
 
-    def load_averagemap(self):
-        if self.new_pandda_output:
-#            imol = coot.map_from_mtz_by_calc_phases(self.zmap, "FGROUND", "PHGROUND", self.mol_dict['protein'])
-            imol = coot.make_and_draw_map(self.zmap, "FGROUND", "PHGROUND", "1", 0, 0)
-            self.mol_dict['averagemap'] = imol
-        elif self.averagemap.endswith(".ccp4"):
-            imol = coot.read_ccp4_map(self.averagemap, 0)
-            self.mol_dict['averagemap'] = imol
-        else:
-            # loads double-maps
-            imol = coot.auto_read_make_and_draw_maps(self.averagemap)
-            self.mol_dict['averagemap'] = imol[0]
-            # may case core-dump
-#            imol = coot.map_from_mtz_by_calc_phases(self.zmap, "FWT", "PHWT", self.mol_dict['protein'])
-#            self.mol_dict['averagemap'] = imol
-        coot.set_colour_map_rotation_on_read_pdb(0)
-        __main__.toggle_display_map(self.mol_dict['averagemap'], self.show_averagemap)
-        coot.set_last_map_colour(0, 0, 1)
+        frame = gtk.Frame(label='Save')
+        hbox = gtk.HBox()
+        self.save_next_button = gtk.Button(label="Save Model")
+        hbox.add(self.save_next_button)
+        self.save_next_button.connect("clicked", self.save_next)
+        frame.add(hbox)
+        self.vbox.pack_start(frame)
 
-    def get_ligcif(self):
-        foundCIF = False
-        ligcif = ''
-        if self.event:
-            if os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal, self.event, 'rhofit', 'best.cif')):
-                ligcif = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, self.event, 'rhofit', 'best.cif')
-                self.logger.info('found ligand cif file: {0!s}'.format(ligcif))
-                foundCIF = True
-        if not foundCIF:
-            for l in glob.glob(os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'ligand_files', '*cif')):
-                ligcif = l
-                self.logger.info('found ligand cif file: {0!s}'.format(ligcif))
-                foundCIF = True
-                break
-        if not foundCIF:
-            self.logger.warning('did not find ligand cif file! Check if this folder contains any files: {0!s}'.format(
-                os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'ligand_files')))
-        return ligcif
+        self.window.add(self.vbox)
+        self.window.show_all()
 
-    def load_ligcif(self):
-        if os.path.isfile(self.ligcif):
-            coot.read_cif_dictionary(os.path.join(self.ligcif))
-            imol = coot.handle_read_draw_molecule_with_recentre(self.ligcif.replace('.cif','.pdb'), 0)
-#            imol = coot.handle_read_draw_molecule_with_recentre(self.ligcif.replace('.cif', '.pdb'), 1)
-            self.mol_dict['ligand'] = imol
-            coot.seqnum_from_serial_number(imol, "X", 0)
-            coot.set_b_factor_residue_range(imol, "X", 1, 1, 20.00)
-            coot.set_occupancy_residue_range(imol, "X", 1, 1, float(self.bdc))
+    def quit(self, widget, event=None):
+        if self.journal_entries > 0:
+            self.save_pandda_inspect_events_csv_file()
+        elif self.eventCSV:
+            # keeps the position in the event list for the next session
+            self.save_session_snapshot()
+        gtk.main_quit()
 
-    def recentre_on_event(self):
-        coot.set_rotation_centre(self.x, self.y, self.z)
+    def set_ligand_confidence(self, widget, data=None):
+#        for n, b in enumerate(self.ligand_confidence_button_list):
+#            print("***********",n,b.get_active())
+        if widget.get_active():
+            self.save_annotation('ligand_confidence', data)
 
-    def reset_params(self):
-        self.xtal = None
-        self.event = None
-        self.bdc = None
-        self.site = None
-        self.pdb = None
-        self.emap = None
-        self.new_pandda_output = False
-        self.zmap = None
-        self.xraymap = None
-        self.averagemap = None
-        self.ligcif = None
-        self.x = None
-        self.y = None
-        self.z = None
-        self.resolution = None
-        self.r_free = None
-        self.r_work = None
-        self.ligand_confidence = None
-        self.merged = False
+    def set_ligand_confidence_button(self):
+        foundItem = False
+        for item in self.ligand_confidence_button_labels:
+            if item[1] == self.ligand_confidence:
+                self.ligand_confidence_button_list[item[0]].set_active(True)
+                foundItem = True
+                break
+        if not foundItem:
+            self.ligand_confidence_button_list[0].set_active(True)
 
-    def update_params(self):
-        missing_files = False
-        self.xtal = self.elist[self.index][self.xtal_index]
-        self.event = self.elist[self.index][self.event_index]
-        self.bdc = self.elist[self.index][self.bdc_index]
-        self.site = self.elist[self.index][self.site_index]
-        self.logger.info('checking if files exist for  {0!s}, event: {1!s}, site: {2!s}'.format(self.xtal, self.event,
-                                                                                          self.site))
-        self.pdb, missing_files = self.get_pdb(missing_files)
-        self.emap, self.new_pandda_output, missing_files = self.get_emap(missing_files)
-        self.zmap, missing_files = self.get_zmap(missing_files)
-        self.xraymap, missing_files = self.get_xraymap(missing_files)
-        self.averagemap = self.get_averagemap()
-        self.ligcif = self.get_ligcif()
-        self.x = float(self.elist[self.index][self.x_index])
-        self.y = float(self.elist[self.index][self.y_index])
-        self.z = float(self.elist[self.index][self.z_index])
-        self.logger.info('event coordinates -> x = {0!s}, y = {1!s}, z = {2!s}'.format(self.x, self.y, self.z))
-        self.resolution = self.elist[self.index][self.resolution_index]
-        self.r_free = self.elist[self.index][self.r_free_index]
-        self.r_work = self.elist[self.index][self.r_work_index]
-        self.ligand_confidence = self.elist[self.index][self.ligand_confidence_index]
-        return missing_files
+    def select_pandda_folder(self, widget):
+        dlg = gtk.FileChooserDialog("Open..", None, gtk.FILE_CHOOSER_ACTION_SELECT_FOLDER,
+                                    (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL, gtk.STOCK_OPEN, gtk.RESPONSE_OK))
+        response = dlg.run()
+        if self.open_pandda_folder(dlg.get_filename()):
+            dlg.destroy()
+            self.resume()
 
     def update_labels(self):
         self.xtal_label.set_label(self.xtal)
@@ -631,155 +2214,46 @@ class inspect_gui(object):
         self.site_label.set_label(self.site)
         self.bdc_label.set_label(self.bdc)
 
-    def current_sample_matches_selection_criteria(self):
-        show_event = False
-        if self.selected_selection_criterion.startswith("show all events"):
-            show_event = True
-        elif self.selected_selection_criterion == "show no ligands bound":
-            if "no ligand bound" in self.ligand_confidence:
-                show_event = True
-        elif self.selected_selection_criterion == "show unknown ligands":
-            if "unknown ligand" in self.ligand_confidence:
-                show_event = True
-        elif self.selected_selection_criterion == "show low confidence ligands":
-            if "low confidence" in self.ligand_confidence:
-                show_event = True
-        elif self.selected_selection_criterion == "show high confidence ligands":
-            if "high confidence" in self.ligand_confidence:
-                show_event = True
-        elif self.selected_selection_criterion == 'show not viewed events':
-            if not 'True' in self.elist[self.index][self.viewed_index]:
-                show_event = True
-        return show_event
-
-    def RefreshData(self):
-
-        self.reset_params()
-
-        if len(__main__.molecule_number_list()) > 0:
-            for item in __main__.molecule_number_list():
-                coot.close_molecule(item)
-
-        self.mol_dict = {
-            'pdb': None,
-            'emap': None,
-            'zmap': None,
-            'ligand': None,
-            'xraymap': None,
-            'averagemap': None
-            }
-
-        self.show_emap = 0
-        self.show_zmap = 0
-        self.show_xraymap = 0
-        self.show_averagemap = 0
-
-        if self.index < 1:
-            self.index = 1
-        if self.index > len(self.elist) - 1:
-            self.index = len(self.elist) - 1
-            self.logger.warning('you reached the end of available events!')
-            return None
-
-        missing_files = self.update_params()
-
-        # check if event fits selection criteria
-        if self.current_sample_matches_selection_criteria() and not missing_files:
-            self.logger.info('loading files for {0!s}, event: {1!s}, site: {2!s}'.format(self.xtal, self.event, self.site))
-            self.set_ligand_confidence_button()
-            self.update_labels()
-            self.recentre_on_event()
-            self.load_ligcif()
-            self.load_pdb()
-            self.load_emap()
-            self.load_zmap()
-            self.load_xraymap()
-            if self.averagemap:
-                self.load_averagemap()
-            self.logger.info('setting event map as RSR map')
-            coot.set_imol_refinement_map(self.mol_dict['emap'])
-
-        elif self.current_sample_matches_selection_criteria() and missing_files:
-            self.logger.error('essential files could not be found, check messages above; skipping...')
-            self.change_event(1)
-        else:
-            self.logger.warning('{0!s}, event: {1!s}, site: {2!s} does not match selection criteria; skipping'.format(self.xtal, self.event, self.site))
-            self.change_event(1)
-
+    def set_average_map_available(self, available):
+        self.toggle_average_map_button.set_sensitive(available)
 
     def place_ligand_here(self, widget):
         self.logger.info('moving ligand to pointer')
         self.logger.info('LIGAND: ', self.mol_dict['ligand'])
-        __main__.move_molecule_here(self.mol_dict['ligand'])
+        self.coot.move_molecule_here(self.mol_dict['ligand'])
 
     def merge_ligand_into_protein(self, widget):
         self.logger.info('merge ligand into protein structure')
         # merge_molecules(list(imols), imol) e.g. merge_molecules([1],0)
-        coot.merge_molecules_py([self.mol_dict['ligand']], self.mol_dict['protein'])
+        self.coot.merge_molecules_py([self.mol_dict['ligand']], self.mol_dict['protein'])
         self.logger.info('removing ligand from molecule list')
-        coot.close_molecule(self.mol_dict['ligand'])
+        self.coot.close_molecule(self.mol_dict['ligand'])
+        # the model is not the one in the file anymore and must not be reused for other events
+        self.molecule_cache.discard(self.mol_dict['protein'])
         self.merged = True
 
     def reset_to_unfitted(self, widget):
-        for imol in __main__.molecule_number_list():
-            if 'pandda-model.pdb' in coot.molecule_name(imol):
+        for imol in self.coot.molecule_number_list():
+            if 'pandda-model.pdb' in self.coot.molecule_name(imol):
                 self.pdb = os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
                                         '{0!s}-pandda-input.pdb'.format(self.xtal))
-                coot.close_molecule(imol)
+                self.molecule_cache.discard(imol)
+                self.coot.close_molecule(imol)
                 self.load_pdb()
                 break
 
-    def check_if_modelled_structures_folder_exists(self):
-        modelled_structures = os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'modelled_structures')
-        if not os.path.isdir(os.path.join(modelled_structures)):
-            self.logger.info('creating folder {0!s}'.format(modelled_structures))
-            os.mkdir(modelled_structures)
-
     def save_next(self, widget):
-        self.check_if_modelled_structures_folder_exists()
-        if os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                                       'modelled_structures', 'fitted-v0001.pdb')):
-            n = []
-            for p in sorted(glob.glob(os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                                                   'modelled_structures', 'fitted-v*.pdb'))):
-                n.append(int(p[p.rfind('fitted-v')+8:].replace('.pdb','')))
-                new = 'fitted-v' + (4-len(str(max(n)+1))) * '0' + str(max(n)+1) + '.pdb'
-        else:
-                new = 'fitted-v0001.pdb'
-        coot.write_pdb_file(self.mol_dict['protein'], os.path.join(
-                    self.panddaDir, 'processed_datasets', self.xtal, 'modelled_structures', new))
-        if os.path.isfile(os.path.join(self.panddaDir, 'processed_datasets', self.xtal,
-                                       'modelled_structures', '{0!s}-pandda-model.pdb'.format(self.xtal))):
-            os.remove(os.path.join(self.panddaDir,'processed_datasets', self.xtal,
-                                   'modelled_structures', '{0!s}-pandda-model.pdb'.format(self.xtal)))
-        os.chdir(os.path.join(self.panddaDir, 'processed_datasets', self.xtal, 'modelled_structures'))
-        if os.name == 'nt':
-            os.popen('copy {0!s} {1!s}-pandda-model.pdb'.format(new, self.xtal))
-        else:
-            os.system('/bin/cp {0!s} {1!s}-pandda-model.pdb'.format(new, self.xtal))
-#            os.symlink(new, '{0!s}-pandda-model.pdb'.format(self.xtal))
-        if self.merged:
-            self.elist[self.index][self.ligand_placed_index] = 'True'
-            self.save_pandda_inspect_events_csv_file()
+        self.save_model()
 
     def select_events(self, widget):
-        self.selected_selection_criterion = self.select_events_combobox.get_active_text()
         self.crystal_progressbar.set_fraction(0)
-        if self.selected_selection_criterion.startswith("show all events - sort by cluster size"):
-            header = self.elist[0]
-            del self.elist[0]
-            self.elist = sorted(self.elist, key=lambda x: x[self.cluster_size_index])
-            self.elist.insert(0, header)
-            self.init_crystal_selection_combobox()
-        elif self.selected_selection_criterion.startswith("show all events - sort alphabetically"):
-            self.logger.info("sorting event alphabetically")
-            header = self.elist[0]
-            del self.elist[0]
-            self.elist = sorted(self.elist, key=lambda x: x[self.xtal_index])
-            self.elist.insert(0, header)
-            self.init_crystal_selection_combobox()
-        self.logger.info("you selected to {0!s}".format(self.selected_selection_criterion))
-        self.index = -1
+        self.select(self.select_events_combobox.get_active_text())
+
+    def add_selection(self, name):
+        self.select_events_combobox.append_text(name)
+
+    def set_selection(self, n):
+        self.select_events_combobox.set_active(n)
 
     def previous_event(self, widget):
         self.change_event(-1)
@@ -794,9 +2268,8 @@ class inspect_gui(object):
                     co = c[1]
 #                    print(nc, co)
                     if nc == n:
-                        self.elist[self.index][self.ligand_confidence_index] = co
                         self.logger.info("saving ligand confidence for event as '{0!s}'".format(co))
-                        self.save_pandda_inspect_events_csv_file()
+                        self.save_annotation('ligand_confidence', co)
                         break
                 break
         self.change_event(1)
@@ -809,166 +2282,47 @@ class inspect_gui(object):
         self.logger.info('moving to next site')
         self.change_site(1)
 
-    def change_site(self, n):
-        current_site = int(self.site)
-        self.logger.info('current site {0!s}'.format(current_site))
-        new_site = current_site + n
-        self.logger.info('new site: {0!s}'.format(new_site))
-        index_increment = 0
-        for i, item in enumerate(self.elist):
-            self.logger.info('{0!s} - {1!s}'.format(i, item[2]))
-            if item[2] == str(new_site):
-                index_increment = i - self.index
-                break
-        self.change_event(index_increment)
-
-    def change_event(self, n):
-        self.index += n
-        self.crystal_progressbar.set_fraction(float(self.index) / float(len(self.elist)))
-        self.update_crystal_selection_combobox()
-        self.RefreshData()
-
-    def update_crystal_selection_combobox(self):
-        self.logger.info('updating crystal selection combobox')
-        x = self.elist[self.index][self.xtal_index]
-        e = self.elist[self.index][self.event_index]
-        s = self.elist[self.index][self.site_index]
-        text = '{0!s} - event: {1!s} - site: {2!s}'.format(x, e, s)
-        for n, i in enumerate(self.cb_list):
-            if i == text:
-                self.cb.set_active(n)
-                break
-
-    def select_crystal(self, widget):
-        tmp = str(widget.get_active_text())
-        self.logger.info('new selection: {0!s}'.format(tmp))
-        tmpx = tmp.replace(' - event: ', ' ').replace(' - site: ', ' ')
-        xtal = tmpx.split()[0]
-        event = tmpx.split()[1]
-        site = tmpx.split()[2]
-        index_increment = 0
-        for n, i in enumerate(self.elist):
-            x = self.elist[n][self.xtal_index]
-            e = self.elist[n][self.event_index]
-            s = self.elist[n][self.site_index]
-            if x == xtal and e == event and s == site:
-                index_increment = n - self.index
-                break
-        self.change_event(index_increment)
-
-    def make_secure_copy_of_original_csv(self, csv_file):
-        csv_original = csv_file + '.original'
-        if not os.path.isfile(csv_original):
-            self.logger.info('creating backup file of {0!s}'.format(csv_file))
-            shutil.copy(csv_file, csv_original)
-
-
-    def initialize_inspect_events_csv_file(self, analyse_csv):
-        self.make_secure_copy_of_original_csv(analyse_csv)
-        r = csv.reader(open(analyse_csv))
-        l = list(r)
-        for i, line in enumerate(l):
-            if i == 0:
-                l[i].extend(['Interesting','Ligand Placed','Ligand Confidence','Comment','Viewed'])
-            else:
-                l[i].extend(['False', 'False', 'Low', 'None', 'False'])
-        with open(os.path.join(self.analysis_folder,'pandda_inspect_events.csv'), 'w') as f:
-            writer = csv.writer(f)
-            writer.writerows(l)
-
-
-    def initialize_inspect_sites_csv_file(self, analyse_csv):
-        self.make_secure_copy_of_original_csv(analyse_csv)
-        r = csv.reader(open(analyse_csv))
-        l = list(r)
-        for i, line in enumerate(l):
-            if i == 0:
-                l[i].extend(['Name','Comment'])
-            else:
-                l[i].extend(['None', 'None'])
-        with open(os.path.join(self.analysis_folder,'pandda_inspect_sites.csv'), 'w') as f:
-            writer = csv.writer(f)
-            writer.writerows(l)
-
-    def parsepanddaDir(self):
-        self.logger.info("reading {0!s}".format(self.eventCSV))
-        r = csv.reader(open(self.eventCSV))
-        self.elist = list(r)
-
-        self.logger.info("reading {0!s}".format(self.siteCSV))
-        r = csv.reader(open(self.siteCSV))
-        self.slist = list(r)
-
-        self.logger.info("getting header fields from {0!s}".format(self.eventCSV))
-        for n, item in enumerate(self.elist[0]): # number of columns at the end can differ
-            if item == 'dtag':
-                self.xtal_index = n
-            if item == 'Ligand Confidence':
-                self.ligand_confidence_index = n
-            if item == 'event_num' or item == 'event_idx':
-                self.event_index = n
-            if item == 'site_num' or item == 'site_idx':
-                self.site_index = n
-            if item == 'bdc' or item == '1-BDC':
-                self.bdc_index = n
-            if item == 'x':
-                self.x_index = n
-            if item == 'y':
-                self.y_index = n
-            if item == 'z':
-                self.z_index = n
-            if item == 'analysed_resolution' or item == 'high_resolution':
-                self.resolution_index = n
-            if item == 'r_work':
-                self.r_work_index = n
-            if item == 'r_free':
-                self.r_free_index = n
-            if item == 'Viewed':
-                self.viewed_index = n
-            if item == 'cluster_size':
-                self.cluster_size_index = n
-            if item == "Ligand Placed":
-                self.ligand_placed_index = n
-        self.show_content_of_event_csv_file()
-
-    def show_content_of_event_csv_file(self):
-        self.logger.info("showing contents of {0!s}:".format(self.eventCSV))
-        for n,i in enumerate(self.elist):
-            if n == 0:
-                continue
-            x = round(float(self.elist[n][self.x_index]), 1)
-            y = round(float(self.elist[n][self.y_index]), 1)
-            z = round(float(self.elist[n][self.z_index]), 1)
-            info = (
-                ' xtal: {0!s}'.format(self.elist[n][self.xtal_index]) +
-                ' - event/site: {0!s}/{1!s}'.format(self.elist[n][self.event_index],self.elist[n][self.site_index]) +
-                ' - BDC: {0!s}'.format(self.elist[n][self.bdc_index]) +
-                ' - x,y,z: {0!s},{1!s},{2!s}'.format(x, y, z) +
-                ' - Resolution: {0!s}'.format(self.elist[n][self.resolution_index]) +
-                ' - Rwork/Rfree: {0!s}/{1!s}'.format(self.elist[n][self.r_work_index],self.elist[n][self.r_free_index]) +
-                ' - viewed: {0!s}'.format(self.elist[n][self.viewed_index]) +
-                ' - ligand confidence: {0!s}'.format(self.elist[n][self.ligand_confidence_index])
-            )
-            self.logger.info(info)
-        self.init_crystal_selection_combobox()
-
-    def init_crystal_selection_combobox(self):
-        self.logger.info('removing all entries from crystal selection combobox')
-        if len(self.elist) != 0:
-            for n, item in enumerate(self.elist):
-                self.cb.remove_text(0)
-        self.logger.info('adding new entries from crystal selection combobox')
-        self.cb_list = []
-        for n,i in sorted(enumerate(self.elist)):
-            if n == 0:
-                continue
-            text = '{0!s} - event: {1!s} - site: {2!s}'.format(self.elist[n][self.xtal_index],
-                                                                            self.elist[n][self.event_index],
-                                                                            self.elist[n][self.site_index])
-            self.cb_list.append(text)
-            self.cb.append_text(text)
-
-
+    def update_progressbar(self):
+        self.crystal_progressbar.set_fraction(float(self.position + 1) / float(len(self.queue)))
+        self.crystal_progressbar.set_text('{0!s} / {1!s}'.format(self.position + 1, len(self.queue)))
+
+    def update_event_selector(self):
+        if 0 <= self.index < len(self.event_store):
+            self.event_view.get_selection().select_path(self.index)
+            self.event_view.scroll_to_cell(self.index)
+
+    def update_event_selector_row(self, row):
+        # refreshes a single row of the event selector after an annotation
+        if 0 <= row < len(self.event_store):
+            self.event_store[row][3] = self.events.get(row, 'ligand_confidence')
+
+    def search_event(self, model, column, key, treeiter, data=None):
+        # typeahead search over crystal, event and site; all words need to match, e.g. "x0123 2";
+        # gtk expects False for a matching row
+        text = ' '.join(model.get(treeiter, 0, 1, 2)).lower()
+        for word in key.lower().split():
+            if word not in text:
+                return True
+        return False
+
+    def select_crystal(self, view, path, column):
+        row = path[0]
+        self.logger.info('new selection: {0!s} - event: {1!s}'.format(self.event_store[row][0],
+                                                                       self.event_store[row][1]))
+        self.change_to_row(row)
+
+    def init_event_selector(self):
+        # the store is filled while detached from the view, so that the view is only updated once
+        self.logger.info('adding events to event selector')
+        self.event_view.set_model(None)
+        self.event_store.clear()
+        dtag = self.events.data[self.events.position['dtag']]
+        event = self.events.data[self.events.position['event']]
+        site = self.events.data[self.events.position['site']]
+        confidence = self.events.data[self.events.position['ligand_confidence']]
+        for n in range(len(self.events)):
+            self.event_store.append([dtag[n], event[n], site[n], confidence[n]])
+        self.event_view.set_model(self.event_store)
 
     def toggle_emap(self, widget):
         if self.mol_dict['emap'] is not None:
@@ -976,7 +2330,7 @@ class inspect_gui(object):
                 self.show_emap = 1
             else:
                 self.show_emap = 0
-            __main__.toggle_display_map(self.mol_dict['emap'], self.show_emap)
+            self.coot.toggle_display_map(self.mol_dict['emap'], self.show_emap)
 
     def toggle_zmap(self, widget):
         if self.mol_dict['zmap'] is not None:
@@ -984,7 +2338,7 @@ class inspect_gui(object):
                 self.show_zmap = 1
             else:
                 self.show_zmap = 0
-            __main__.toggle_display_map(self.mol_dict['zmap'], self.show_zmap)
+            self.coot.toggle_display_map(self.mol_dict['zmap'], self.show_zmap)
 
     def toggle_x_ray_maps(self, widget):
         if self.mol_dict['xraymap'] is not None:
@@ -992,8 +2346,8 @@ class inspect_gui(object):
                 self.show_xraymap = 1
             else:
                 self.show_xraymap = 0
-            __main__.toggle_display_map(self.mol_dict['xraymap'][0], self.show_xraymap)
-            __main__.toggle_display_map(self.mol_dict['xraymap'][1], self.show_xraymap)
+            self.coot.toggle_display_map(self.mol_dict['xraymap'][0], self.show_xraymap)
+            self.coot.toggle_display_map(self.mol_dict['xraymap'][1], self.show_xraymap)
 
     def toggle_average_map(self, widget):
         if self.mol_dict['averagemap'] is not None:
@@ -1001,10 +2355,15 @@ class inspect_gui(object):
                 self.show_averagemap = 1
             else:
                 self.show_averagemap = 0
-            __main__.toggle_display_map(self.mol_dict['averagemap'], self.show_averagemap)
+            self.coot.toggle_display_map(self.mol_dict['averagemap'], self.show_averagemap)
 
     def CANCEL(self, widget):
         self.window.destroy()
 
+
 if __name__ == '__main__':
-    inspect_gui().startGUI()
+    if len(sys.argv) > 2 and sys.argv[1] == '--timings':
+        # python inspect_pandda_analyse.py --timings [--all] inspect.timings.jsonl
+        summarize_timings(sys.argv[-1], '--all' in sys.argv)
+    else:
+        inspect_gui().startGUI()
@@ -0,0 +1,110 @@
+import os
+import sys
+import csv
+import shutil
+import logging
+import tempfile
+import unittest
+
+repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repository)
+sys.path.insert(0, os.path.join(repository, 'benchmark'))
+
+import make_pandda_dir
+from inspect_pandda_analyse import inspect_session, stub_coot
+
+
+class test_replay(unittest.TestCase):
+    # navigation and annotation sequences against a synthetic PanDDA1 directory, with COOT replaced by stub_coot
+
+    def setUp(self):
+        self.panddaDir = tempfile.mkdtemp()
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            # 6 events in 3 datasets: x00001 1-2, x00002 1-2, x00003 1-2
+            make_pandda_dir.make_pandda_dir(self.panddaDir, 6, 2, 3, 1, 0)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        self.logger = logging.getLogger('test_replay')
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            self.logger.addHandler(logging.NullHandler())
+
+    def tearDown(self):
+        shutil.rmtree(self.panddaDir)
+
+    def open_session(self):
+        coot = stub_coot()
+        session = inspect_session(coot, self.logger, None)
+        session.prefetch_depth = 0
+        self.assertTrue(session.open_pandda_folder(self.panddaDir))
+        return session, coot
+
+    def read_annotations(self, session):
+        # dtag, event -> (ligand confidence, viewed)
+        with open(session.eventCSV) as f:
+            rows = list(csv.reader(f))
+        header = rows[0]
+        columns = [header.index(c) for c in ('dtag', 'event_idx', 'Ligand Confidence', 'Viewed')]
+        return dict(((row[columns[0]], row[columns[1]]), (row[columns[2]], row[columns[3]])) for row in rows[1:])
+
+    def test_navigate_annotate_save(self):
+        session, coot = self.open_session()
+        timings = session.replay([
+            ['select', 'show all events'],
+            ['next'],
+            ['annotate', 'ligand_confidence', 'High'],
+            ['viewed'],
+            ['next'],
+            ['next'],
+            ['annotate', 'ligand_confidence', 'Medium'],
+            ['save_model'],
+            ['previous'],
+            ['viewed']
+        ])
+        self.assertEqual([t[0] for t in timings][:3], ['select', 'next', 'annotate'])
+        self.assertEqual(session.position, 1)
+        self.assertEqual((session.xtal, session.event), ('x00001', '2'))
+        self.assertEqual(coot.calls['write_pdb_file'], 1)
+        modelled_structures = os.path.join(self.panddaDir, 'processed_datasets', 'x00002', 'modelled_structures')
+        self.assertEqual(sorted(os.listdir(modelled_structures)), ['fitted-v0001.pdb', 'x00002-pandda-model.pdb'])
+
+        # annotations are only in the journal until the CSV file is saved
+        with open(session.annotation_journal()) as f:
+            journal = list(csv.reader(f))
+        self.assertEqual(journal, [['x00001', '1', 'Ligand Confidence', 'High'],
+                                   ['x00001', '1', 'Viewed', 'True'],
+                                   ['x00002', '1', 'Ligand Confidence', 'Medium'],
+                                   ['x00001', '2', 'Viewed', 'True']])
+        self.assertEqual(self.read_annotations(session)[('x00001', '1')], ('Low', 'False'))
+
+        session.save_pandda_inspect_events_csv_file()
+        self.assertFalse(os.path.isfile(session.annotation_journal()))
+        annotations = self.read_annotations(session)
+        self.assertEqual(annotations[('x00001', '1')], ('High', 'True'))
+        self.assertEqual(annotations[('x00001', '2')], ('Low', 'True'))
+        self.assertEqual(annotations[('x00002', '1')], ('Medium', 'False'))
+        self.assertEqual(annotations[('x00003', '2')], ('Low', 'False'))
+
+    def test_journal_and_position_after_crash(self):
+        # the window is never closed, so only the journal and the position file are left behind
+        session, coot = self.open_session()
+        session.replay([['select', 'show all events'], ['next'], ['next'], ['next'],
+                        ['annotate', 'ligand_confidence', 'High']])
+        self.assertEqual((session.xtal, session.event), ('x00002', '1'))
+
+        session, coot = self.open_session()
+        self.assertEqual(session.selected_selection_criterion, 'show all events')
+        self.assertEqual(session.position, 2)
+        self.assertEqual(self.read_annotations(session)[('x00002', '1')], ('High', 'False'))
+        session.replay([['previous'], ['previous'], ['previous'], ['previous']])
+        self.assertEqual(session.position, 0)
+        self.assertEqual((session.xtal, session.event), ('x00001', '1'))
+        session.replay([['next']])
+        self.assertEqual((session.xtal, session.event), ('x00001', '2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from inspect_pandda_analyse import percentile
+
+
+class test_percentile(unittest.TestCase):
+    # nearest-rank: the smallest value with at least p percent of the values at or below it
+
+    def test_nearest_rank(self):
+        values = list(range(1, 21))
+        self.assertEqual(percentile(values, 95), 19)
+        self.assertEqual(percentile(values, 50), 10)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+
+    def test_bounds(self):
+        values = [0.1, 0.2, 0.5]
+        self.assertEqual(percentile(values, 0), 0.1)
+        self.assertEqual(percentile(values, 100), 0.5)
+        self.assertEqual(percentile([7], 95), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()